@@ -12,6 +12,10 @@
 ###########
 # Imports #
 ###########
+# Time imports when started with --import-times (must come first)
+from functions import startup
+startup.install()
+
 # Import GUI packages
 import tkinter as tk
 from tkinter import ttk
@@ -19,12 +23,9 @@ from tkinter import messagebox
 
 # Import system packages
 import os
+import sqlite3
 from pathlib import Path
 
-# Import misc packages
-import webbrowser
-import markdown
-
 # Import custom modules
 # Menu imports
 from menus import mainmenu
@@ -36,9 +37,19 @@ from exceptions import audio_exceptions
 from models import sessionmodel
 from models import versionmodel
 from models import audiomodel
+from models import audiobackend
+from models import audioengine
+from models import deviceregistry
 from models import calmodel
 from models import csvmodel
+from models import journalmodel
+from models import sqlitemodel
+from models import recordsink
 from models import stimulusmodel
+from models import stimuluscache
+from models import maskermodel
+from models import prefetchmodel
+from models import timingmodel
 # View imports
 from views import mainview
 from views import sessionview
@@ -95,9 +106,29 @@ class Application(tk.Tk):
         # Load CSV writer model
         self.csvmodel = csvmodel.CSVModel(self.sessionpars)
 
+        # Recover data from sessions that did not finish
+        self._recover_journals()
+
         # Load calibration model
         self.calmodel = calmodel.CalModel(self.sessionpars)
 
+        # Load audio backend, device registry and audio engine
+        self._create_audio_backend()
+
+        # Load stimulus cache (filled when the task starts)
+        self.stimcache = stimuluscache.StimulusCache(
+            self.sessionpars['stim_cache_mb'].get())
+
+        # Trial prefetcher, masker and session snapshot (created 
+        # when the task starts)
+        self.prefetcher = None
+        self.masker = None
+        self.snapshot = None
+        self.record_sink = None
+        self.journal = None
+        self.store = None
+        self.timer = None
+
         # Load main view
         #self.grid_columnconfigure(0, weight=1) # center widget
         #self.grid_rowconfigure(0, weight=1) # center widget
@@ -138,7 +169,7 @@ class Application(tk.Tk):
             '<<CalibrationSubmit>>': lambda _: self._calc_offset(),
 
             # Audio dialog commands
-            '<<AudioDialogSubmit>>': lambda _: self._save_sessionpars(),
+            '<<AudioDialogSubmit>>': lambda _: self._on_audio_dialog_submit(),
 
             # Main View commands
             '<<MainYes>>': lambda _: self._on_yes(),
@@ -153,41 +184,86 @@ class Application(tk.Tk):
         # Center main window
         self.center_window()
 
-        # Check for updates
+        # Check for updates in the background (results are polled,
+        # so a slow file server does not delay startup)
+        self.version_check = None
+        self._version_reported = False
         if (self.sessionpars['check_for_updates'].get() == 'yes') and \
         (self.sessionpars['config_file_status'].get() == 1):
-            _filepath = self.sessionpars['version_lib_path'].get()
-            u = versionmodel.VersionChecker(_filepath, self.NAME, self.VERSION)
-            if u.status == 'mandatory':
-                messagebox.showerror(
-                    title="New Version Available",
-                    message="A mandatory update is available. Please install " +
-                        f"version {u.new_version} to continue.",
-                    detail=f"You are using version {u.app_version}, but " +
-                        f"version {u.new_version} is available."
-                )
-                self.destroy()
-            elif u.status == 'optional':
-                messagebox.showwarning(
-                    title="New Version Available",
-                    message="An update is available.",
-                    detail=f"You are using version {u.app_version}, but " +
-                        f"version {u.new_version} is available."
-                )
-            elif u.status == 'current':
-                pass
-            elif u.status == 'app_not_found':
-                messagebox.showerror(
-                    title="Update Check Failed",
-                    message="Cannot retrieve version number!",
-                    detail=f"'{self.NAME}' does not exist in the version library."
-                 )
-            elif u.status == 'library_inaccessible':
-                messagebox.showerror(
-                    title="Update Check Failed",
-                    message="The version library is unreachable!",
-                    detail="Please check that you have access to Starfile."
-                )
+            self.version_check = versionmodel.BackgroundVersionCheck(
+                self.sessionpars['version_lib_path'].get(),
+                self.NAME,
+                self.VERSION,
+                cache_path=(self.sessionpars_model.filepath.parent / 
+                    'version_library.csv')
+            )
+            self.after(100, self._poll_version_check)
+
+
+    def _poll_version_check(self):
+        """ Report the version check result once it is available.
+        """
+        if not self.version_check.done():
+            self.after(100, self._poll_version_check)
+            return
+        if not self._version_reported:
+            self._show_version_status()
+
+
+    def _show_version_status(self):
+        """ Display the result of the version check.
+        """
+        self._version_reported = True
+        u = self.version_check
+        if u.status == 'mandatory':
+            messagebox.showerror(
+                title="New Version Available",
+                message="A mandatory update is available. Please install " +
+                    f"version {u.new_version} to continue.",
+                detail=f"You are using version {u.app_version}, but " +
+                    f"version {u.new_version} is available. The task " +
+                    "cannot be started until you update."
+            )
+        elif u.status == 'optional':
+            messagebox.showwarning(
+                title="New Version Available",
+                message="An update is available.",
+                detail=f"You are using version {u.app_version}, but " +
+                    f"version {u.new_version} is available."
+            )
+        elif u.status == 'current':
+            pass
+        elif u.status == 'app_not_found':
+            messagebox.showerror(
+                title="Update Check Failed",
+                message="Cannot retrieve version number!",
+                detail=f"'{self.NAME}' does not exist in the version library."
+             )
+        elif u.status == 'library_inaccessible':
+            messagebox.showerror(
+                title="Update Check Failed",
+                message="The version library is unreachable!",
+                detail="Please check that you have access to Starfile."
+            )
+
+
+    def _version_allows_task(self):
+        """ Return False if a mandatory update is available. Waits 
+            for a pending version check (up to its timeout).
+        """
+        if self.version_check is None:
+            return True
+        if not self.version_check.done():
+            print("\ncontroller: Waiting for version check...")
+            self.version_check.wait()
+            if not self._version_reported:
+                self._show_version_status()
+                return self.version_check.status != 'mandatory'
+
+        if self.version_check.status == 'mandatory':
+            self._show_version_status()
+            return False
+        return True
 
 
     #####################
@@ -216,6 +292,28 @@ class Application(tk.Tk):
     def _quit(self):
         """ Exit the application.
         """
+        # Save trial data first: it must not depend on the settings
+        self._close_record_sink()
+        self._close_journal()
+        self._close_store()
+        self.csvmodel.close()
+        if self.timer is not None:
+            self.timer.close()
+
+        # An empty or invalid entry must not stop the app closing
+        try:
+            self._flush_sessionpars()
+        except (tk.TclError, ValueError) as e:
+            print(f"controller: Session parameters not saved: {e}")
+            messagebox.showwarning(
+                title="Settings Not Saved",
+                message="Could not save the session parameters!",
+                detail=e
+            )
+
+        self.audio_engine.close()
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
         self.destroy()
 
 
@@ -243,6 +341,7 @@ class Application(tk.Tk):
         try:
             self.a = audiomodel.Audio(
                 audio=audio,
+                **self._audio_kwargs(),
                 **kwargs
             )
         except FileNotFoundError:
@@ -257,20 +356,79 @@ class Application(tk.Tk):
             raise
 
 
-    def _play(self, pres_level):
+    def _audio_kwargs(self):
+        """ Keyword arguments for creating audiomodel.Audio objects.
+        """
+        session = self._session()
+        return {
+            'cache': self.stimcache,
+            'stream_threshold': session.stream_threshold_s,
+            'stream_buffer_mb': session.stream_buffer_mb,
+            'session_fs': session.session_fs or None,
+            'ramp_shape': session.ramp_shape,
+            'ramp_dur': session.ramp_dur_ms / 1000,
+            'backend': self.audio_backend
+        }
+
+
+    def _play(self, pres_level, prepared=False):
         """ Format channel routing, present audio and catch 
-            exceptions.
+            exceptions. If PREPARED is True, self.a has already 
+            been prepared (e.g., by the prefetcher).
         """
         # Attempt to present audio
         try:
-            self.a.play(
-                level=pres_level,
-                device_id=self.sessionpars['audio_device'].get(),
-                routing=self._format_routing(
-                    self.sessionpars['channel_routing'].get())
-            )
+            if not prepared:
+                device_id, routing = self._playback_settings()
+                self.a.prepare(
+                    level=pres_level,
+                    device_id=device_id,
+                    routing=routing,
+                    registry=self.device_registry
+                )
+            # Keep the background masker running on this stream
+            delay = 0.0
+            if self.masker is not None:
+                try:
+                    masker = self.masker.buffer(self.a.fs)
+                except audio_exceptions.Clipping:
+                    # Not the target: report the masker level
+                    print("controller: Masker clipping! Aborting!")
+                    messagebox.showerror(
+                        title="Clipping",
+                        message="The masker level is too high and " +
+                            "causes clipping.",
+                        detail="Go to File>Session to lower the masker " +
+                            "level."
+                    )
+                    return
+                self.audio_engine.start_masker(
+                    masker,
+                    device_id=self.a.device_id,
+                    fs=self.a.fs,
+                    routing=self.a.routing
+                )
+                delay = self._session().target_delay_ms / 1000
+            if self.a.streaming:
+                self.current_source = self.audio_engine.play_stream(
+                    self.a.open_stream(),
+                    device_id=self.a.device_id,
+                    fs=self.a.fs,
+                    routing=self.a.routing,
+                    delay=delay
+                )
+            else:
+                self.current_source = self.audio_engine.play(
+                    self.a.temp,
+                    device_id=self.a.device_id,
+                    fs=self.a.fs,
+                    routing=self.a.routing,
+                    delay=delay
+                )
         except audio_exceptions.InvalidAudioDevice as e:
             print(e)
+            # Device list may be out of date
+            self._rescan_devices()
             messagebox.showerror(
                 title="Invalid Device",
                 message="Invalid audio device! Go to Tools>Audio Settings " +
@@ -301,11 +459,26 @@ class Application(tk.Tk):
             self.a.plot_waveform("Clipped Waveform")
 
 
+    def _show_planned_clipping(self, trials):
+        """ Summarize trials that would clip.
+        """
+        max_rows = 15
+        lines = [f"Trial {row.trial}: {row.stimulus} " +
+            f"(peak {row.peak_dBFS:+.1f} dB FS)" 
+            for row in trials.head(max_rows).itertuples()]
+        if len(trials) > max_rows:
+            lines.append(f"...and {len(trials) - max_rows} more " +
+                "(see console)")
+        messagebox.showerror(
+            title="Clipping",
+            message=f"{len(trials)} trial(s) would clip at the " +
+                "current calibration. The task has not been started.",
+            detail="\n".join(lines)
+        )
+
+
     def stop_audio(self):
-        try:
-            self.a.stop()
-        except AttributeError:
-            print("\ncontroller: Stop called, but there is no audio object!")
+        self.audio_engine.stop()
 
 
     def _format_routing(self, routing):
@@ -327,6 +500,14 @@ class Application(tk.Tk):
             Create stimulus model.
             Present first trial.
         """
+        # Do not start if a mandatory update is available
+        if not self._version_allows_task():
+            return
+
+        # Freeze session parameters for the task
+        self.snapshot = sessionmodel.SessionSnapshot.from_vars(
+            self.sessionpars)
+
         # Create trial counter
         self.trial_counter = 0
 
@@ -337,15 +518,61 @@ class Application(tk.Tk):
         self.bind('1', lambda event: self.main_frame._on_yes())
         self.bind('2', lambda event: self.main_frame._on_no())
 
+        # Create stimulus cache using current memory budget
+        self.stimcache = stimuluscache.StimulusCache(
+            self.snapshot.stim_cache_mb)
+
         # Create stimulus model
         try:
-            self.stimmodel = stimulusmodel.StimulusModel(self.sessionpars)
+            self.stimmodel = stimulusmodel.StimulusModel(
+                self.snapshot, cache=self.stimcache)
         except FileNotFoundError:
             messagebox.showerror(
                 title="File Not Found",
                 message="Cannot find matrix file!",
                 detail="Go to File>Session to specify a valid matrix file path."
             )
+            self._abort_start()
+            return
+        except RuntimeError as e:
+            # Stimulus file that cannot be decoded 
+            # (soundfile.LibsndfileError)
+            print(e)
+            messagebox.showerror(
+                title="Invalid Audio File",
+                message="Cannot read a stimulus file in the matrix!",
+                detail=e
+            )
+            self._abort_start()
+            return
+
+        # Load background masker
+        try:
+            self.masker = self._load_masker()
+        except FileNotFoundError:
+            messagebox.showerror(
+                title="File Not Found",
+                message="Cannot find the masker file!",
+                detail="Go to File>Session to specify a valid masker file."
+            )
+            self._abort_start()
+            return
+        except audio_exceptions.Clipping:
+            messagebox.showerror(
+                title="Clipping",
+                message="The masker level is too high and causes clipping.",
+                detail="Go to File>Session to lower the masker level."
+            )
+            self._abort_start()
+            return
+
+        # Check the whole trial plan for clipping before starting
+        try:
+            self.stimmodel.validate_levels(self.calmodel,
+                masker_peak=self.masker.peak if self.masker else 0.0)
+        except audio_exceptions.PlannedClipping as e:
+            self._show_planned_clipping(e.trials)
+            self._abort_start()
             return
 
         # Get trial matrix from stimulusmodel
@@ -353,17 +580,224 @@ class Application(tk.Tk):
         print('\ncontroller: Trial matrix')
         print(self.matrix)
 
-        # Update trial label
-        self._update_trial_label()
+        # Set how often trial data are flushed to disk (only used 
+        # without the journal: see csvmodel)
+        if not self.snapshot.journal:
+            self.csvmodel.set_flush_policy(self.snapshot.flush_records,
+                self.snapshot.flush_seconds)
+
+        # Trials per block (one pass through the matrix file)
+        self.block_len = max(
+            self.matrix.shape[0] // max(self.snapshot.repetitions, 1), 1)
+
+        # Journal trial data (compacted into the .csv file when the 
+        # session ends)
+        if self.snapshot.journal:
+            try:
+                self.journal = self._open_journal()
+            except OSError as e:
+                self._on_save_error(e)
+                self._abort_start()
+                return
+
+        # Optionally also save to the SQLite database
+        if self.snapshot.sqlite_store:
+            try:
+                self.store = self._open_store()
+            except (OSError, sqlite3.Error) as e:
+                self._on_save_error(e)
+                self._close_journal()
+                self._abort_start()
+                return
+
+        # Write trial data on a background thread
+        self.record_sink = recordsink.RecordSink(self._write_record)
+        self.after(200, self._poll_record_sink)
+
+        # Create trial timer (and optional timing log)
+        self.timer = timingmodel.TrialTimer(self._timing_log_path())
+
+        # Create trial prefetcher
+        self.prefetcher = prefetchmodel.TrialPrefetcher(
+            registry=self.device_registry,
+            index=self.stimmodel.index,
+            **self._audio_kwargs()
+        )
 
-        # Apply offset to desired dB level
-        # (Also update sessionpars)
-        self._calc_level(self.matrix.iloc[self.trial_counter, 1])
+        # Present first trial
+        self.present_trial()
 
-        # Present trial
-        self.present_audio(
-            audio=Path(self.matrix.iloc[self.trial_counter, 0]),
-            pres_level=self.sessionpars['adjusted_level_dB'].get()
+
+    def _abort_start(self):
+        """ Undo start_task() set-up after a failed start.
+        """
+        self.snapshot = None
+        self.menu.file_menu.entryconfig('Start Task', state='normal')
+        self.unbind('1')
+        self.unbind('2')
+
+
+    def _open_journal(self):
+        """ Create the trial journal and record the session and
+            the trial order.
+        """
+        session = self._session()
+        filename = f"{session.subject}_" + \
+            f"{session.condition}_" + \
+            f"{self.csvmodel.datestamp}{journalmodel.TrialJournal.SUFFIX}"
+        journal = journalmodel.TrialJournal(
+            os.path.join(self.csvmodel.data_directory, filename))
+        journal.write_header(
+            session=dict(session.as_dict(), 
+                datestamp=self.csvmodel.datestamp),
+            columns=self.matrix.columns,
+            trials=self.matrix.values.tolist()
+        )
+        return journal
+
+
+    def _close_journal(self):
+        """ Compact the trial journal into the .csv file. Returns 
+            False if that failed (already reported; the journal is 
+            kept and recovered at the next start).
+        """
+        if self.journal is None:
+            return True
+        journal, self.journal = self.journal, None
+        try:
+            journal.compact()
+        except OSError as e:
+            self._on_save_error(e)
+            return False
+        return True
+
+
+    def _open_store(self):
+        """ Open the SQLite database and add this session.
+        """
+        store = sqlitemodel.SQLiteModel(os.path.join(
+            self.csvmodel.data_directory, sqlitemodel.SQLiteModel.FILENAME))
+        store.start_session(self._session().as_dict(), 
+            self.csvmodel.datestamp, self.VERSION)
+        return store
+
+
+    def _close_store(self):
+        """ Write any batched trials to the SQLite database and 
+            close it. Returns False if that failed (already 
+            reported).
+        """
+        if self.store is None:
+            return True
+        store, self.store = self.store, None
+        try:
+            store.close()
+        except sqlite3.Error as e:
+            self._on_save_error(e)
+            return False
+        return True
+
+
+    def _recover_journals(self):
+        """ Compact journals left by sessions that did not finish 
+            (e.g., after a crash) into their .csv files.
+        """
+        for path in journalmodel.find_journals(self.csvmodel.data_directory):
+            print(f"\ncontroller: Recovering {path.name}...")
+            try:
+                csv_path, header, records = journalmodel.compact(path)
+            except OSError as e:
+                print(e)
+                messagebox.showwarning(
+                    title="Recovery Failed",
+                    message=f"Could not recover data from {path.name}!",
+                    detail=e
+                )
+                continue
+
+            trials = header['trials'] if header else []
+            if len(records) < len(trials):
+                next_trial = f"The next trial would have been trial " + \
+                    f"{len(records) + 1}: {trials[len(records)][0]}"
+            else:
+                next_trial = "All trials were completed."
+            messagebox.showinfo(
+                title="Session Recovered",
+                message="Recovered data from a session that did not finish.",
+                detail=f"{len(records)} of {len(trials) or '?'} trial(s) " +
+                    f"saved to {csv_path}.\n{next_trial}"
+            )
+
+
+    def _session(self):
+        """ Session parameters as a SessionSnapshot: the task 
+            snapshot while a task is running, otherwise the current
+            values.
+        """
+        if self.snapshot is not None:
+            return self.snapshot
+        return sessionmodel.SessionSnapshot.from_vars(self.sessionpars)
+
+
+    def _load_masker(self):
+        """ Create the background masker from sessionpars, or 
+            return None if no masker file is set. The masker is 
+            scaled and checked for clipping before the task starts.
+        """
+        session = self._session()
+        path = session.masker_file
+        if not path:
+            return None
+        if not os.access(path, os.F_OK):
+            raise FileNotFoundError(path)
+
+        masker = maskermodel.Masker(
+            path,
+            self.calmodel.adjusted_level(session.masker_level_dB,
+                session.slm_offset),
+            cache=self.stimcache
+        )
+        masker.buffer(session.session_fs or None)
+        return masker
+
+
+    def _playback_settings(self):
+        """ Return current (device_id, routing).
+        """
+        session = self._session()
+        return (
+            session.audio_device,
+            self._format_routing(session.channel_routing)
+        )
+
+
+    def _timing_log_path(self):
+        """ Path to the timing log, or None if disabled.
+        """
+        session = self._session()
+        if not session.timing_log:
+            return None
+        filename = f"{session.subject}_" + \
+            f"{session.condition}_" + \
+            f"{self.csvmodel.datestamp}_timing.csv"
+        return os.path.join(self.csvmodel.data_directory, filename)
+
+
+    def _prefetch_next(self):
+        """ Start preparing the next trial in the background.
+        """
+        trial = self.trial_counter + 1
+        if trial >= self.matrix.shape[0]:
+            return
+
+        # Resolve calibrated level on the Tk thread
+        level = self.calmodel.adjusted_level(self.matrix.iloc[trial, 1],
+            self.snapshot.slm_offset)
+        self.prefetcher.submit(
+            trial, 
+            Path(self.matrix.iloc[trial, 0]), 
+            level,
+            *self._playback_settings()
         )
 
 
@@ -389,6 +823,9 @@ class Application(tk.Tk):
             Assign response value and save to file.
             Present next trial.
         """
+        # Record response time
+        self.timer.mark('t_submit')
+
         # Select keys to write to file
         save_list = ['trial', 'stimulus', 'subject', 'condition', 
             'randomize', 'repetitions', 'slm_reading', 'cal_level_dB', 
@@ -399,7 +836,8 @@ class Application(tk.Tk):
             self.stimmodel.prep_data(
                 current_trial=self.trial_counter, 
                 response=self.response,
-                save_list=save_list
+                save_list=save_list,
+                levels=self.trial_levels
             )
         except KeyError as e:
             messagebox.showerror(
@@ -410,53 +848,154 @@ class Application(tk.Tk):
             self.destroy()
             return
 
+        # Add timing columns
+        self.stimmodel.trial_data.update(
+            self.timer.finish(self.trial_counter + 1, self.current_source))
+
         # Save the trial data
         self._save_trial_data(self.stimmodel.trial_data)
 
         # Increase trial counter
         self.trial_counter += 1
 
+        # Sync trial data to disk at the end of each block
+        if self.trial_counter % self.block_len == 0:
+            self.record_sink.call(self._end_block, self.trial_counter)
+
         # Present trial
         self.present_trial()
 
 
-    def _save_trial_data(self, data):
-        # Write data to file
-        print('\ncontroller: Calling save record function...')
-        try:
+    def _write_record(self, data):
+        """ Save one trial record (called on the record sink's 
+            worker thread).
+        """
+        if self.journal is not None:
+            self.journal.append(data)
+        else:
             self.csvmodel.save_record(data)
-        except PermissionError as e:
-            print(e)
+        if self.store is not None:
+            self.store.save_record(data)
+
+
+    def _end_block(self, trial):
+        """ Sync saved trial data to disk at the end of the block 
+            ending with TRIAL (called on the record sink's worker 
+            thread).
+        """
+        print(f"\ncontroller: End of block (trial {trial})")
+        if self.journal is not None:
+            self.journal.sync()
+        else:
+            self.csvmodel.end_block()
+        if self.store is not None:
+            self.store.flush()
+
+
+    def _save_trial_data(self, data):
+        # Queue data to be written to file (written in the background)
+        print('\ncontroller: Queueing record for saving...')
+        self.record_sink.put(data)
+
+
+    def _poll_record_sink(self):
+        """ Check for write errors from the record sink.
+        """
+        if self.record_sink is None:
+            return
+        errors = self.record_sink.errors()
+        if errors:
+            self._on_save_error(errors[0])
+            self._quit()
+            return
+        self.after(200, self._poll_record_sink)
+
+
+    def _on_save_error(self, e):
+        """ Report a failed write.
+        """
+        print(e)
+        if isinstance(e, PermissionError):
             messagebox.showerror(
                 title="Access Denied",
                 message="Data not saved! Cannot write to file!",
                 detail=e
             )
-            self.destroy()
-            return
+        else:
+            messagebox.showerror(
+                title="Save Failed",
+                message="Data not saved!",
+                detail=e
+            )
+
+
+    def _close_record_sink(self):
+        """ Write all queued records and stop the record sink.
+            Returns False if a write failed (already reported).
+        """
+        if self.record_sink is None:
+            return True
+        self.record_sink.drain()
+        errors = self.record_sink.errors()
+        self.record_sink.close()
+        self.record_sink = None
+        if errors:
+            self._on_save_error(errors[0])
+            return False
+        return True
 
 
     def present_trial(self):
         if self.trial_counter < self.matrix.shape[0]:
+            # Start timing this trial
+            self.timer.mark('t_present_call')
+            self.current_source = None
+
             # Update trial label
             self._update_trial_label()
 
             # Convert db level to scaling factor
-            # Updates sessionpars
-            self._calc_level(self.matrix.iloc[self.trial_counter, 1])
-
-            self.present_audio(
-                audio=Path(self.matrix.iloc[self.trial_counter, 0]),
-                pres_level=self.sessionpars['adjusted_level_dB'].get()
+            pres_level = self._calc_level(
+                self.matrix.iloc[self.trial_counter, 1])
+
+            # Use the prefetched audio if it matches this trial
+            audio = Path(self.matrix.iloc[self.trial_counter, 0])
+            prepared = self.prefetcher.take(
+                self.trial_counter, audio, pres_level, 
+                *self._playback_settings()
             )
+            if prepared is not None:
+                self.a = prepared
+                self._play(pres_level, prepared=True)
+            else:
+                self.present_audio(
+                    audio=audio,
+                    pres_level=pres_level,
+                    index=self.stimmodel.index
+                )
+
+            self.timer.mark('t_present_return')
+
+            # Prepare next trial while the participant responds
+            self._prefetch_next()
         else:
             print("\ncontroller: Task complete! Goodbye!")
+            self.audio_engine.stop_masker()
+            self.masker = None
+            self.snapshot = None
+            self.timer.summary()
+            self.timer.close()
+            if not (self._close_record_sink() and self._close_journal()
+                and self._close_store()):
+                self._quit()
+                return
+            self.csvmodel.close()
             messagebox.showinfo(
                 title="Task Complete",
                 message="Please let the investigator know you have " +
                     "finished the task!"
             )
-            self.destroy()
+            self._quit()
             return
 
 
@@ -490,12 +1029,20 @@ class Application(tk.Tk):
 
 
     def _save_sessionpars(self, *_):
-        """ Save current runtime parameters to file 
+        """ Save current runtime parameters to file. The file is 
+            only written if a value changed.
+        """
+        self._flush_sessionpars()
+
+
+    def _flush_sessionpars(self):
+        """ Copy the Tk variables to the sessionpars model and 
+            write any changes now.
         """
         print("\ncontroller: Calling sessionpars model set and save funcs")
         for key, variable in self.sessionpars.items():
             self.sessionpars_model.set(key, variable.get())
-            self.sessionpars_model.save()
+        self.sessionpars_model.save()
 
 
     ########################
@@ -505,7 +1052,70 @@ class Application(tk.Tk):
         """ Show audio settings dialog
         """
         print("\ncontroller: Calling audio dialog...")
-        audioview.AudioDialog(self, self.sessionpars)
+        audioview.AudioDialog(self, self.sessionpars, self.device_registry,
+            self.audio_engine)
+
+    def _on_audio_dialog_submit(self):
+        """ Save audio settings and apply the backend and latency 
+            profile.
+        """
+        self._save_sessionpars()
+        if self.sessionpars['audio_backend'].get() != self.audio_backend.name:
+            self.audio_engine.close()
+            self._create_audio_backend()
+        else:
+            self.audio_engine.set_profile(self._latency_profile())
+
+    def _create_audio_backend(self):
+        """ Create the audio backend from sessionpars, and the 
+            device registry and audio engine that use it.
+        """
+        name = self.sessionpars['audio_backend'].get()
+        try:
+            self.audio_backend = audiobackend.get_backend(name)
+        except (OSError, ValueError) as e:
+            # PortAudio library missing or unknown backend name
+            print(f"controller: Cannot load {name} audio backend: {e}")
+            messagebox.showwarning(
+                title="Audio Backend",
+                message=f"Cannot load the '{name}' audio backend!",
+                detail="Using the virtual audio device: nothing will " +
+                    "be heard. Go to Tools>Audio Settings to select " +
+                    "another backend."
+            )
+            self.audio_backend = audiobackend.get_backend('virtual')
+            self.sessionpars['audio_backend'].set('virtual')
+
+        # Enumerate audio devices in the background
+        self.device_registry = deviceregistry.DeviceRegistry(
+            backend=self.audio_backend)
+        self.device_registry.refresh()
+
+        # Load audio engine (streams stay open between trials)
+        self.audio_engine = audioengine.AudioEngine(
+            registry=self.device_registry,
+            profile=self._latency_profile(),
+            backend=self.audio_backend
+        )
+
+    def _rescan_devices(self):
+        """ Close all streams and re-enumerate audio devices, 
+            picking up devices that were plugged in or removed.
+        """
+        self.audio_engine.close()
+        self.device_registry.refresh(rescan=True)
+
+
+    def _latency_profile(self):
+        """ Audio engine latency profile from sessionpars.
+        """
+        return {
+            'latency': self.sessionpars['latency'].get(),
+            'blocksize': self.sessionpars['blocksize'].get(),
+            'dither_off': bool(self.sessionpars['dither_off'].get()),
+            'wasapi_exclusive': bool(
+                self.sessionpars['wasapi_exclusive'].get())
+        }
 
     def _show_calibration_dialog(self):
         """ Display the calibration dialog window
@@ -539,12 +1149,26 @@ class Application(tk.Tk):
 
 
     def _calc_level(self, desired_spl):
-        """ Calculate new dB FS level using slm_offset.
+        """ Calculate new dB FS level using the slm_offset from 
+            the task snapshot. Returns the adjusted level.
         """
         # Calculate new presentation level
-        self.calmodel.calc_level(desired_spl)
-        # Save level - this must be called here!
-        self._save_sessionpars()
+        desired_spl = float(desired_spl)
+        adjusted = float(self.calmodel.adjusted_level(desired_spl,
+            self.snapshot.slm_offset))
+        self.trial_levels = {
+            'desired_level_dB': desired_spl,
+            'adjusted_level_dB': adjusted
+        }
+        print(f"\ncontroller: Desired level in dB: {desired_spl}")
+        print(f"controller: Adjusted level (dB): {adjusted}")
+
+        # Mirror levels in the GUI variables. They are saved when 
+        # the task ends (see _quit()): the task runs from the 
+        # snapshot, so config.json is not rewritten every trial.
+        self.sessionpars['desired_level_dB'].set(desired_spl)
+        self.sessionpars['adjusted_level_dB'].set(adjusted)
+        return adjusted
 
 
     #######################
@@ -553,6 +1177,10 @@ class Application(tk.Tk):
     def _show_help(self):
         """ Create html help file and display in default browser
         """
+        # Only needed for help, so not imported at startup
+        import webbrowser
+        import markdown
+
         print("controller: Looking for help file in compiled " +
             "version temp location...")
         help_file = general.resource_path('README\\README.html')
@@ -577,4 +1205,5 @@ class Application(tk.Tk):
 
 if __name__ == "__main__":
     app = Application()
+    startup.report()
     app.mainloop()
@@ -9,6 +9,18 @@ class Clipping(Exception):
     """ Audio clipping has occurred """
 
 
+class PlannedClipping(Exception):
+    """ One or more trials in the trial plan would clip """
+
+    def __init__(self, trials, *args):
+        super().__init__(args)
+        self.trials = trials
+
+
+    def __str__(self):
+        return f'Audio Exception: {len(self.trials)} trial(s) would clip.'
+
+
 class InvalidAudioDevice(Exception):
     """ Invalid audio device """
 
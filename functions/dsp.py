@@ -0,0 +1,264 @@
+""" Vectorized signal processing functions.
+
+    Signals are arrays with time along the first axis and any
+    number of channels along the remaining axes.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+from math import gcd
+from functools import lru_cache
+
+
+#########
+# Funcs #
+#########
+def peak_stats(hi, lo, dc=None):
+    """ Per-channel 'peak' (absolute), and if DC is given, 'dc' 
+        and 'peak_ac' (peak after removing the DC offset), from 
+        per-channel maxima HI and minima LO. Used wherever peaks 
+        are computed (gain_stage() and the stimulus index), so the 
+        values always agree.
+    """
+    stats = {'peak': np.maximum(hi, -lo)}
+    if dc is not None:
+        stats['dc'] = dc
+        stats['peak_ac'] = np.maximum(hi - dc, dc - lo)
+    return stats
+
+
+def signal_stats(signal, dc=True):
+    """ peak_stats() of SIGNAL (one reduction per statistic, no
+        temporary arrays). The DC offset is only computed if DC.
+    """
+    hi = np.max(signal, axis=0).astype(float)
+    lo = np.min(signal, axis=0).astype(float)
+    mean = np.mean(signal, axis=0, dtype=np.float64) if dc else None
+    return peak_stats(hi, lo, mean)
+
+
+def gain_stage(signal, level_dB=None, out=None, stats=None):
+    """ Apply gain to SIGNAL and report the resulting peak.
+
+        level_dB: gain in dB applied to every channel. If None,
+            each channel has its DC offset removed and is
+            normalized to a peak of 1/(number of channels).
+        out: optional float32 output buffer (may be SIGNAL itself
+            if SIGNAL is a writeable float32 array)
+        stats: optional precomputed per-channel 'peak', 'peak_ac' 
+            and 'dc' values (see stimulusindex.StimulusIndex); 
+            when given, SIGNAL is not scanned before the gain is 
+            applied
+
+        Returns (out, peak), where peak is the absolute peak of the
+        output. The peak is derived from reductions over the input,
+        so no extra pass over the output is needed to check clipping.
+    """
+    if out is None:
+        out = np.empty(signal.shape, dtype=np.float32)
+
+    if stats is None:
+        # DC is only needed for normalization
+        stats = signal_stats(signal, dc=level_dB is None)
+
+    num_channels = max(int(np.prod(signal.shape[1:])), 1)
+    gain, dc, peak = plan_gain(stats, level_dB, num_channels)
+
+    # Apply DC removal and gain
+    if dc is not None:
+        np.subtract(signal, dc, out=out, casting='unsafe')
+        np.multiply(out, gain, out=out, casting='unsafe')
+    else:
+        np.multiply(signal, gain, out=out, casting='unsafe')
+
+    return out, peak
+
+
+def plan_gain(stats, level_dB=None, num_channels=1):
+    """ Work out the gain for a signal from its per-channel STATS
+        without touching the samples.
+
+        Returns (gain, dc, peak): the gain to apply, the DC offset 
+        to subtract first (None when LEVEL_DB is given), and the 
+        absolute peak after gain.
+    """
+    if level_dB is None:
+        # Remove DC offset and normalize each channel
+        dc = np.asarray(stats['dc'])
+        peak_in = np.asarray(stats['peak_ac'])
+        # Leave silent channels silent
+        gain = np.divide(1.0, peak_in * num_channels,
+            out=np.zeros_like(peak_in), where=peak_in > 0)
+        peak = float(np.max(peak_in * gain))
+    else:
+        dc = None
+        gain = db2mag(level_dB)
+        peak = float(np.max(stats['peak'])) * gain
+
+    return gain, dc, peak
+
+
+def db2mag(db, out=None):
+    """ Convert decibels to magnitude. Accepts scalars or arrays
+        of any shape; OUT is an optional float output array.
+    """
+    if out is None:
+        return np.power(10.0, np.divide(db, 20))
+    np.divide(db, 20, out=out)
+    return np.power(10.0, out, out=out)
+
+
+def mag2db(mag, out=None):
+    """ Convert magnitude to decibels. Accepts scalars or arrays
+        of any shape; OUT is an optional float output array.
+    """
+    if out is None:
+        return 20 * np.log10(mag)
+    np.log10(mag, out=out)
+    return np.multiply(out, 20, out=out)
+
+
+def rms(sig, axis=None, keepdims=False):
+    """ Root mean square of SIG over AXIS (all samples if None).
+        Computed in float64 to avoid integer overflow.
+    """
+    return np.sqrt(np.mean(np.square(sig, dtype=np.float64), axis=axis,
+        keepdims=keepdims))
+
+
+def set_rms(sig, amp, axis=0, eq=False, out=None):
+    """ Set the RMS level of each channel of SIG.
+
+        amp: target RMS level in dB (re: 1.0)
+        axis: the time axis; all other axes are channels
+        eq: if True, every channel is set to AMP. If False, 
+            inter-channel level differences are kept and the mean 
+            channel level (in dB) is set to AMP.
+        out: optional output array (may be SIG itself)
+
+        Example:
+            stereo = np.column_stack([tone1, tone2])
+            adjusted = set_rms(stereo, -15)
+    """
+    with np.errstate(divide='ignore'):
+        levels = mag2db(rms(sig, axis=axis, keepdims=True))
+    audible = np.isfinite(levels)
+
+    if eq or not audible.any():
+        target = amp
+    else:
+        # Shift all channels together, keeping level differences
+        target = amp + levels - np.mean(levels[audible])
+
+    # Gain in dB (silent channels are left unchanged)
+    gain = np.zeros_like(levels)
+    np.subtract(target, levels, out=gain, where=audible)
+    db2mag(gain, out=gain)
+
+    return np.multiply(sig, gain, out=out)
+
+
+def peak_margin_dB(peak):
+    """ Headroom in dB between PEAK and full scale (1.0).
+        Negative values indicate clipping.
+    """
+    if peak <= 0:
+        return np.inf
+    return -20 * np.log10(peak)
+
+
+def minmax_envelope(signal, bins):
+    """ Split SIGNAL into (at most) BINS runs of frames and return
+        (starts, lo, hi): the first frame of each run and the 
+        per-channel minimum and maximum of each run, as 
+        (runs x channels) arrays. Used to draw long signals at 
+        screen resolution.
+    """
+    frames = len(signal)
+    signal = signal.reshape(frames, -1)
+    starts = np.unique(np.linspace(0, frames, min(bins, frames),
+        endpoint=False).astype(int))
+    lo = np.minimum.reduceat(signal, starts, axis=0)
+    hi = np.maximum.reduceat(signal, starts, axis=0)
+    return starts, lo, hi
+
+
+RAMP_SHAPES = ('none', 'cos2', 'linear')
+
+
+@lru_cache(maxsize=32)
+def ramp_window(shape, dur, fs):
+    """ Onset ramp of DUR seconds at FS (the offset ramp is the 
+        same window reversed). Windows are cached and read-only; 
+        they broadcast against any number of channels.
+
+        shape: 'cos2' (cosine-squared) or 'linear'
+    """
+    n = int(round(dur * fs))
+    x = np.arange(n) / max(n, 1)
+    if shape == 'cos2':
+        window = np.square(np.sin(np.pi / 2 * x))
+    elif shape == 'linear':
+        window = x
+    else:
+        raise ValueError(f"Unknown ramp shape: {shape}")
+    window = window.astype(np.float32)
+    window.flags.writeable = False
+    return window
+
+
+def apply_ramps(signal, shape, dur, fs, start=0, total=None):
+    """ Apply onset and offset ramps to SIGNAL in place. Only the 
+        ramp regions are touched.
+
+        shape: one of RAMP_SHAPES ('none' or None leaves SIGNAL 
+            unchanged)
+        dur: ramp duration in seconds (shortened to half the 
+            signal if necessary)
+        start, total: for block-wise processing, the position of 
+            SIGNAL within a signal of TOTAL frames
+    """
+    if total is None:
+        total = len(signal)
+    dur = min(dur, (total // 2) / fs)
+    if shape in (None, 'none') or dur <= 0:
+        return signal
+
+    window = ramp_window(shape, dur, fs)
+    # View with one column per channel axis for broadcasting
+    window = window.reshape((-1,) + (1,) * (signal.ndim - 1))
+    n = len(window)
+    stop = start + len(signal)
+
+    # Onset ramp: frames [0, n)
+    if start < n:
+        seg = signal[:min(stop, n) - start]
+        np.multiply(seg, window[start:min(stop, n)], out=seg,
+            casting='unsafe')
+
+    # Offset ramp: frames [total - n, total)
+    offset = total - n
+    if stop > offset:
+        first = max(start, offset)
+        seg = signal[first - start:]
+        np.multiply(seg, window[::-1][first - offset:stop - offset],
+            out=seg, casting='unsafe')
+
+    return signal
+
+
+def resample(signal, fs_in, fs_out):
+    """ Resample SIGNAL from FS_IN to FS_OUT along the time axis 
+        using a polyphase filter. Returns a float32 array.
+    """
+    # scipy is slow to import and only needed for mixed-rate sets
+    from scipy.signal import resample_poly
+
+    divisor = gcd(int(fs_in), int(fs_out))
+    up = int(fs_out) // divisor
+    down = int(fs_in) // divisor
+    return resample_poly(signal, up, down, axis=0).astype(np.float32,
+        copy=False)
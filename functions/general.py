@@ -36,3 +36,12 @@ def truncate_path(long_path):
             return 'Please select a file'
         else:
             return long_path
+
+
+def json_default(value):
+    """ Convert values json cannot serialize (e.g., NumPy scalars 
+        in trial records). Use as json.dumps(..., default=...).
+    """
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
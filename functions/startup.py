@@ -0,0 +1,94 @@
+""" Startup timing.
+
+    Start the app with --import-times to print how long each module
+    import took and the total startup time, compared against
+    STARTUP_BUDGET_S. Import times are inclusive (a module's time
+    includes the modules it imports), similar to python -X
+    importtime, but this also works in the PyInstaller build.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import sys
+import time
+import builtins
+
+
+#############
+# Constants #
+#############
+# Target time from launch until the main window is ready (seconds)
+STARTUP_BUDGET_S = 1.5
+
+# Launch time (this module is imported first)
+T0 = time.perf_counter()
+
+# Command line switch
+ENABLED = '--import-times' in sys.argv
+
+
+#########
+# Funcs #
+#########
+# Recorded imports: (depth, module name, seconds)
+_records = []
+_depth = 0
+_original_import = builtins.__import__
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """ Time first-time imports (replaces builtins.__import__).
+    """
+    global _depth
+
+    # Resolve relative imports and submodules in FROMLIST
+    # (e.g., 'from models import audiomodel')
+    base = name
+    if level and globals and globals.get('__package__'):
+        parent = globals['__package__'].rsplit('.', level - 1)[0]
+        base = f"{parent}.{name}" if name else parent
+    module = sys.modules.get(base)
+    new = [f"{base}.{item}" for item in (fromlist or ())
+        if item != '*' and not hasattr(module, item)]
+    if module is not None and not new:
+        return _original_import(name, globals, locals, fromlist, level)
+
+    label = ', '.join(new) if module is not None else base
+    _depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _depth -= 1
+        _records.append((_depth, label, time.perf_counter() - start))
+
+
+def install():
+    """ Start timing imports if --import-times was given.
+    """
+    if ENABLED:
+        builtins.__import__ = _timed_import
+
+
+def report(threshold_ms=1.0):
+    """ Print import times (imports faster than THRESHOLD_MS are
+        left out) and the total startup time against the budget.
+    """
+    if not ENABLED:
+        return
+    builtins.__import__ = _original_import
+    total = time.perf_counter() - T0
+
+    # Listed in completion order: nested imports come before (and 
+    # are indented under) the module that imported them
+    print("\nstartup: Import times (ms, inclusive)")
+    for depth, name, seconds in _records:
+        if seconds * 1000 >= threshold_ms:
+            print(f"startup: {seconds * 1000:9.1f}  " +
+                f"{'  ' * depth}{name}")
+    print(f"startup: Total startup time: {total:.2f} s " +
+        f"(budget {STARTUP_BUDGET_S:.2f} s)")
+    if total > STARTUP_BUDGET_S:
+        print("startup: Startup budget exceeded!")
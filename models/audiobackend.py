@@ -0,0 +1,281 @@
+""" Audio backends.
+
+    The audio models talk to the sound card through a backend
+    object, so they do not depend on PortAudio directly:
+
+        SoundDeviceBackend: real devices (via sounddevice/PortAudio)
+        VirtualBackend: a simulated output device that runs the
+            stream callback in (simulated) real time, or faster.
+            Used for headless runs and benchmarks on machines 
+            without a sound card. With record=True (tests and 
+            benchmarks only) it keeps every block it would have
+            played; the app uses it with recording off.
+
+    Both backends provide the same methods: query_devices(),
+    query_hostapis(), check_output_settings(), OutputStream(),
+    exclusive_settings(), play(), stop() and reinitialize(), and an
+    Error exception class.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import threading
+import time
+from types import SimpleNamespace
+
+
+#########
+# Funcs #
+#########
+def get_backend(name='sounddevice', **kwargs):
+    """ Create the backend called NAME (see BACKENDS).
+    """
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown audio backend: {name}")
+    print(f"\naudiobackend: Using {name} audio backend")
+    return backend(**kwargs)
+
+
+#########
+# BEGIN #
+#########
+class SoundDeviceBackend:
+    """ Real audio devices through sounddevice (PortAudio).
+    """
+    name = 'sounddevice'
+
+    def __init__(self):
+        # Importing sounddevice fails without the PortAudio library
+        import sounddevice as sd
+        self.sd = sd
+        self.Error = sd.PortAudioError
+
+
+    def query_devices(self, device=None):
+        return self.sd.query_devices(device)
+
+
+    def query_hostapis(self, index=None):
+        return self.sd.query_hostapis(index)
+
+
+    def check_output_settings(self, device=None, samplerate=None):
+        self.sd.check_output_settings(device=device, samplerate=samplerate)
+
+
+    def OutputStream(self, **kwargs):
+        return self.sd.OutputStream(**kwargs)
+
+
+    def exclusive_settings(self):
+        """ Host API settings for exclusive mode (WASAPI).
+        """
+        return self.sd.WasapiSettings(exclusive=True)
+
+
+    def play(self, data, samplerate=None, mapping=None, device=None):
+        self.sd.play(data, samplerate=samplerate, mapping=mapping,
+            device=device)
+
+
+    def stop(self):
+        self.sd.stop()
+
+
+    def reinitialize(self):
+        """ Restart PortAudio so its device list is rebuilt (it is
+            only built when PortAudio is initialized). All streams 
+            must be closed first.
+        """
+        self.sd._terminate()
+        self.sd._initialize()
+
+
+class VirtualDeviceError(Exception):
+    """ Invalid virtual device settings """
+
+
+class VirtualBackend:
+    """ Simulated output device that records what it plays.
+    """
+    name = 'virtual'
+    Error = VirtualDeviceError
+    SAMPLE_RATES = (22050, 44100, 48000, 88200, 96000, 192000)
+
+    def __init__(self, channels=8, speed=1.0, record=False):
+        """ channels: number of device output channels
+            speed: playback speed re: real time (0 = as fast as
+                possible)
+            record: keep a copy of every output block and every
+                buffer passed to play() (memory grows for as long
+                as a stream is open: tests and benchmarks only)
+        """
+        self.channels = channels
+        self.speed = speed
+        self.record = record
+
+        # Open streams and buffers passed to play() (if recording)
+        self.streams = []
+        self.played = []
+
+        self._devices = [{
+            'name': 'Virtual Output',
+            'hostapi': 0,
+            'max_input_channels': 0,
+            'max_output_channels': channels,
+            'default_low_output_latency': 0.005,
+            'default_high_output_latency': 0.02,
+            'default_samplerate': 48000.0
+        }]
+
+
+    def query_devices(self, device=None):
+        if device is None:
+            return list(self._devices)
+        self._check_device(device)
+        return self._devices[device]
+
+
+    def query_hostapis(self, index=None):
+        hostapis = ({'name': 'Virtual', 'devices': [0]},)
+        return hostapis if index is None else hostapis[index]
+
+
+    def check_output_settings(self, device=None, samplerate=None):
+        self._check_device(device)
+        if samplerate is not None and samplerate not in self.SAMPLE_RATES:
+            raise VirtualDeviceError(f"Invalid sampling rate: {samplerate}")
+
+
+    def OutputStream(self, **kwargs):
+        stream = VirtualStream(self, **kwargs)
+        self.streams.append(stream)
+        return stream
+
+
+    def exclusive_settings(self):
+        return None
+
+
+    def play(self, data, samplerate=None, mapping=None, device=None):
+        self.check_output_settings(device, samplerate)
+        if self.record:
+            self.played.append({'data': np.array(data), 
+                'fs': samplerate, 'mapping': mapping, 'device': device})
+
+
+    def stop(self):
+        pass
+
+
+    def reinitialize(self):
+        pass
+
+
+    def _check_device(self, device):
+        if device not in range(len(self._devices)):
+            raise VirtualDeviceError(f"Invalid device: {device}")
+
+
+class VirtualStream:
+    """ Output stream of the virtual device. A worker thread calls
+        the stream callback block by block, paced by the clock.
+    """
+    # Block size used when the host API would choose one
+    DEFAULT_BLOCKSIZE = 512
+
+    def __init__(self, backend, samplerate, device, channels,
+        callback, dtype='float32', latency='low', blocksize=0,
+        dither_off=False, extra_settings=None):
+        backend.check_output_settings(device, samplerate)
+        if channels > backend.channels:
+            raise VirtualDeviceError(f"Invalid number of channels: " +
+                f"{channels}")
+
+        self.backend = backend
+        self.samplerate = samplerate
+        self.channels = channels
+        self.callback = callback
+        self.dtype = dtype
+        self.blocksize = blocksize or self.DEFAULT_BLOCKSIZE
+
+        # Resolve latency like PortAudio does
+        device_info = backend.query_devices(device)
+        if latency == 'low':
+            self.latency = device_info['default_low_output_latency']
+        elif latency == 'high':
+            self.latency = device_info['default_high_output_latency']
+        else:
+            self.latency = float(latency)
+
+        # Output blocks (if recording) and frame counter
+        self.blocks = []
+        self.frames = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+    def close(self):
+        self.stop()
+        if self in self.backend.streams:
+            self.backend.streams.remove(self)
+
+
+    def recording(self):
+        """ Return everything written to the stream as one
+            (frames x channels) array.
+        """
+        if not self.blocks:
+            return np.zeros((0, self.channels), dtype=self.dtype)
+        return np.concatenate(self.blocks)
+
+
+    def _run(self):
+        """ Call the stream callback once per block (worker thread).
+        """
+        t0 = time.perf_counter()
+        outdata = np.zeros((self.blocksize, self.channels),
+            dtype=self.dtype)
+        while not self._stop.is_set():
+            # Stream times in seconds since the stream started
+            now = time.perf_counter() - t0
+            stream_time = SimpleNamespace(currentTime=now,
+                outputBufferDacTime=now + self.latency)
+            self.callback(outdata, self.blocksize, stream_time, None)
+            if self.backend.record:
+                self.blocks.append(outdata.copy())
+            self.frames += self.blocksize
+
+            # Wait until this block would have been played
+            if self.backend.speed > 0:
+                due = self.frames / (self.samplerate * self.backend.speed)
+                delay = due - (time.perf_counter() - t0)
+                if delay > 0:
+                    self._stop.wait(delay)
+
+
+# Available backends by name
+BACKENDS = {
+    SoundDeviceBackend.name: SoundDeviceBackend,
+    VirtualBackend.name: VirtualBackend
+}
@@ -0,0 +1,395 @@
+""" Audio engine for low-latency playback.
+
+    Keeps one long-lived output stream open per device,
+    sampling rate and channel routing. Stimulus buffers are handed
+    to the running stream and written out by the stream callback,
+    so PortAudio does not open and close a stream on every trial.
+
+    The callback also mixes: an optional background masker is 
+    looped continuously, and each trial's target is added on top 
+    of it starting at a sample-accurate frame of the stream.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import threading
+from time import perf_counter
+
+# Import custom modules
+from exceptions import audio_exceptions
+from models import audiobackend
+
+
+#########
+# BEGIN #
+#########
+class ArraySource:
+    """ Playback source for an in-memory buffer.
+    """
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.pos = 0
+
+        # First-sample times, set by the stream callback
+        self.onset = None
+        self.onset_dac = None
+
+
+    def fill(self, outdata, mapping):
+        """ Mix the next frames into OUTDATA. Returns True when 
+            the whole buffer has been written.
+        """
+        start = self.pos
+        stop = min(start + len(outdata), len(self.buffer))
+        block = self.buffer[start:stop]
+        if block.ndim == 1:
+            outdata[:stop-start, mapping[0]] += block
+        else:
+            outdata[:stop-start, mapping] += block
+        self.pos = stop
+        return stop >= len(self.buffer)
+
+
+    def close(self):
+        pass
+
+
+class LoopSource:
+    """ Playback source that loops an in-memory buffer (e.g., a 
+        background masker) until it is stopped. Mono buffers are 
+        sent to every routed channel.
+    """
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.pos = 0
+
+
+    def fill(self, outdata, mapping):
+        """ Mix the next frames into OUTDATA, wrapping around at 
+            the end of the buffer. Never finishes.
+        """
+        frames = len(outdata)
+        length = len(self.buffer)
+        written = 0
+        while length and written < frames:
+            n = min(frames - written, length - self.pos)
+            block = self.buffer[self.pos:self.pos+n].reshape(n, -1)
+            outdata[written:written+n, mapping] += block[:, :len(mapping)]
+            written += n
+            self.pos = (self.pos + n) % length
+        return False
+
+
+    def close(self):
+        pass
+
+
+class AudioEngine:
+    """ Owns persistent output streams and feeds them audio buffers.
+    """
+    # Default latency profile (sounddevice defaults apart from latency)
+    DEFAULT_PROFILE = {
+        'latency': 'low',
+        'blocksize': 0,
+        'dither_off': False,
+        'wasapi_exclusive': False
+    }
+
+    def __init__(self, registry=None, profile=None, backend=None):
+        """ registry: optional deviceregistry.DeviceRegistry used to
+                look up host APIs
+            profile: optional latency profile dict (see 
+                DEFAULT_PROFILE) applied when streams are opened
+            backend: audiobackend backend (sounddevice by default)
+        """
+        self.registry = registry
+        self.backend = backend or audiobackend.get_backend()
+        self.profile = dict(self.DEFAULT_PROFILE)
+        if profile is not None:
+            self.profile.update(profile)
+
+        # Open streams: (device_id, fs, routing) -> OutputStream
+        # (at most one per device)
+        self._streams = {}
+
+        # Output latency (s) reported by each open stream
+        self.reported_latency = {}
+
+        # Playback state shared with the stream callback
+        self._lock = threading.Lock()
+        self._source = None
+        self._mapping = None
+        self._active_key = None
+        self._start_frame = 0
+
+        # Background masker state
+        self._masker = None
+        self._masker_mapping = None
+        self._masker_key = None
+
+        # Frames written by each open stream (the mixing timeline)
+        self._frames = {}
+
+
+    def play(self, buffer, device_id, fs, routing, delay=0.0):
+        """ Queue BUFFER for playback on the stream matching 
+            DEVICE_ID, FS and ROUTING, DELAY seconds after the 
+            current stream position. Returns the playback source, 
+            whose onset times are set once playback starts.
+        """
+        source = ArraySource(buffer)
+        self._start(source, device_id, fs, routing, delay)
+        print("audioengine: Buffer queued for playback")
+        return source
+
+
+    def play_stream(self, stream, device_id, fs, routing, delay=0.0):
+        """ Play a streammodel.BlockStream on the stream matching 
+            DEVICE_ID, FS and ROUTING, DELAY seconds after the 
+            current stream position.
+        """
+        self._start(stream, device_id, fs, routing, delay)
+        print("audioengine: Block stream queued for playback")
+        return stream
+
+
+    def start_masker(self, buffer, device_id, fs, routing):
+        """ Loop BUFFER continuously on the stream matching 
+            DEVICE_ID, FS and ROUTING, underneath any targets. 
+            Calling again with the same buffer and stream keeps 
+            the masker running without a restart.
+        """
+        key = (device_id, int(fs), tuple(routing))
+        with self._lock:
+            if (self._masker is not None and self._masker_key == key
+                and self._masker.buffer is buffer):
+                return
+
+        # Mono maskers go to every channel; otherwise each routed 
+        # channel needs a masker channel
+        if buffer.ndim > 1 and buffer.shape[1] < len(routing):
+            raise audio_exceptions.InvalidRouting(buffer.shape[1],
+                list(routing))
+
+        self._get_stream(key)
+        with self._lock:
+            self._masker = LoopSource(buffer)
+            self._masker_mapping = [chan - 1 for chan in routing]
+            self._masker_key = key
+        print("audioengine: Background masker started")
+
+
+    def stop_masker(self):
+        """ Stop the background masker. The stream stays open.
+        """
+        with self._lock:
+            masker, self._masker = self._masker, None
+            self._masker_key = None
+        if masker is not None:
+            print("audioengine: Background masker stopped")
+
+
+    def stop(self):
+        """ Stop the current source. The stream stays open.
+        """
+        with self._lock:
+            source, self._source = self._source, None
+        if source is not None:
+            source.close()
+
+
+    def _start(self, source, device_id, fs, routing, delay=0.0):
+        """ Make SOURCE the active playback source, starting 
+            DELAY seconds after the current stream position.
+        """
+        key = (device_id, int(fs), tuple(routing))
+        self._get_stream(key)
+
+        with self._lock:
+            previous, self._source = self._source, source
+            self._mapping = [chan - 1 for chan in routing]
+            self._active_key = key
+            self._start_frame = (self._frames.get(key, 0) + 
+                round(delay * key[1]))
+        if previous is not None:
+            previous.close()
+
+
+    def set_profile(self, profile):
+        """ Update the latency profile. Open streams are closed so 
+            the new profile applies when they are reopened.
+        """
+        new_profile = dict(self.DEFAULT_PROFILE)
+        new_profile.update(profile)
+        if new_profile != self.profile:
+            print(f"audioengine: New latency profile: {new_profile}")
+            self.profile = new_profile
+            self.close()
+
+
+    def latency_report(self):
+        """ Describe the latency reported by the active (or most 
+            recently opened) stream.
+        """
+        key = self._active_key
+        if key not in self.reported_latency:
+            if not self.reported_latency:
+                return "No stream open"
+            key = list(self.reported_latency)[-1]
+        latency = self.reported_latency[key]
+        return f"{latency * 1000:.1f} ms (device {key[0]}, {key[1]} Hz)"
+
+
+    def close(self):
+        """ Stop and close all open streams.
+        """
+        self.stop()
+        self.stop_masker()
+        for key in list(self._streams):
+            self._close_stream(key)
+        self._active_key = None
+
+
+    def _close_stream(self, key):
+        """ Stop and close the stream for KEY, along with any 
+            source or masker playing on it.
+        """
+        with self._lock:
+            if self._active_key == key:
+                source, self._source = self._source, None
+                self._active_key = None
+            else:
+                source = None
+            if self._masker_key == key:
+                self._masker = None
+                self._masker_key = None
+                print("audioengine: Background masker stopped")
+        if source is not None:
+            source.close()
+
+        stream = self._streams.pop(key)
+        try:
+            stream.stop()
+            stream.close()
+        except self.backend.Error as e:
+            print(f"audioengine: Error closing stream: {e}")
+        self._frames.pop(key, None)
+        self.reported_latency.pop(key, None)
+
+
+    def _get_stream(self, key):
+        """ Return the running stream for KEY, opening it if needed.
+            Only one stream is kept open per device: a stream with 
+            other settings on the same device is closed first.
+        """
+        if key in self._streams:
+            return self._streams[key]
+
+        device_id, fs, routing = key
+        for old_key in [k for k in self._streams if k[0] == device_id]:
+            print(f"audioengine: Closing output stream (device " +
+                f"{device_id}, {old_key[1]} Hz, routing " +
+                f"{list(old_key[2])})")
+            self._close_stream(old_key)
+
+        print(f"audioengine: Opening output stream (device {device_id}, " +
+            f"{fs} Hz, routing {list(routing)})")
+        try:
+            stream = self.backend.OutputStream(
+                samplerate=fs,
+                device=device_id,
+                channels=max(routing),
+                dtype='float32',
+                callback=self._make_callback(key),
+                latency=self._parse_latency(self.profile['latency']),
+                blocksize=int(self.profile['blocksize']),
+                dither_off=bool(self.profile['dither_off']),
+                extra_settings=self._extra_settings(device_id)
+            )
+            stream.start()
+        except (self.backend.Error, ValueError, KeyError):
+            raise audio_exceptions.InvalidAudioDevice(device_id)
+
+        # Report the latency the device actually gave us
+        self.reported_latency[key] = stream.latency
+        print("audioengine: Reported output latency: " +
+            f"{stream.latency * 1000:.1f} ms")
+
+        self._streams[key] = stream
+        return stream
+
+
+    def _parse_latency(self, latency):
+        """ Convert a profile latency ('low', 'high' or seconds) 
+            to a sounddevice latency argument.
+        """
+        if str(latency).strip().lower() in ('low', 'high'):
+            return str(latency).strip().lower()
+        try:
+            return float(latency)
+        except ValueError:
+            print(f"audioengine: Invalid latency '{latency}'; using 'low'")
+            return 'low'
+
+
+    def _extra_settings(self, device_id):
+        """ Host-API-specific settings (WASAPI exclusive mode).
+        """
+        if not self.profile['wasapi_exclusive']:
+            return None
+
+        if self.registry is not None:
+            hostapi = self.registry.get(device_id)['hostapi']
+        else:
+            device = self.backend.query_devices(device_id)
+            hostapi = self.backend.query_hostapis(device['hostapi'])['name']
+
+        if 'WASAPI' in hostapi:
+            return self.backend.exclusive_settings()
+        print(f"audioengine: Exclusive mode is WASAPI only ({hostapi})")
+        return None
+
+
+    def _make_callback(self, key):
+        """ Create the output callback for the stream matching KEY.
+        """
+        fs = key[1]
+
+        def callback(outdata, frames, time, status):
+            outdata.fill(0)
+            with self._lock:
+                # Position of this block on the stream timeline
+                frame = self._frames.get(key, 0)
+                self._frames[key] = frame + frames
+
+                # Loop the background masker
+                if self._masker is not None and self._masker_key == key:
+                    self._masker.fill(outdata, self._masker_mapping)
+
+                if self._source is None or self._active_key != key:
+                    return
+
+                # Wait for the target's start frame
+                offset = max(self._start_frame - frame, 0)
+                if offset >= frames:
+                    return
+
+                # Record when the first sample will reach the DAC
+                if self._source.onset is None:
+                    self._source.onset_dac = (time.outputBufferDacTime +
+                        offset / fs)
+                    latency = time.outputBufferDacTime - time.currentTime
+                    # Some host APIs do not report stream times
+                    if not time.currentTime or latency < 0:
+                        latency = 0
+                    self._source.onset = (perf_counter() + latency + 
+                        offset / fs)
+
+                # Mix the next block into the routed output channels
+                if self._source.fill(outdata[offset:], self._mapping):
+                    # Release source when finished
+                    self._source = None
+
+        return callback
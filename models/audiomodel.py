@@ -7,20 +7,36 @@
 # Import data science packages
 import numpy as np
 
-import matplotlib.pyplot as plt
-from matplotlib import rcParams
-rcParams.update({'figure.autolayout': True})
-
 # Import system packages
 import os
 from pathlib import Path
 
 # Import audio packages
 import soundfile as sf
-import sounddevice as sd
 
 # Import custom modules
 from exceptions import audio_exceptions
+from functions import dsp
+from models import audiobackend
+from models import streammodel
+from models import stimulusindex
+
+
+#########
+# Funcs #
+#########
+def read_wav(path):
+    """ Decode an audio file straight into a single preallocated 
+        float32 buffer. Returns (signal, fs). Mono files return a 
+        1-D array.
+    """
+    with sf.SoundFile(path) as f:
+        if f.channels == 1:
+            signal = np.empty(f.frames, dtype=np.float32)
+        else:
+            signal = np.empty((f.frames, f.channels), dtype=np.float32)
+        f.read(out=signal)
+        return signal, f.samplerate
 
 
 #########
@@ -33,12 +49,34 @@ class Audio:
     def __init__(self, audio, **kwargs):
         """ Create audio object using file path or signal array
             audio: a Path object from pathlib, or a numpy array
-            kwargs: must provide a sampling rate when passing an array
+            kwargs: must provide a sampling rate when passing an array;
+                optionally provide a stimuluscache.StimulusCache as 
+                'cache' to avoid decoding the same file repeatedly,
+                and a stimulusindex.StimulusIndex as 'index' to use 
+                precomputed statistics instead of scanning samples.
+                Files longer than 'stream_threshold' seconds are 
+                streamed in blocks during playback, using at most 
+                'stream_buffer_mb' of memory. If 'session_fs' is 
+                given, audio is resampled to that rate. 'ramp_shape'
+                (see dsp.RAMP_SHAPES) and 'ramp_dur' (seconds) add
+                onset/offset ramps during prepare(). 'backend' is 
+                the audiobackend backend used to query devices and
+                for play()/stop() (sounddevice by default).
         """
         # Assign public attributes
         self.audio = audio
         if 'sampling_rate' in kwargs:
             self.fs = kwargs['sampling_rate']
+        self.cache = kwargs.get('cache', None)
+        self.index = kwargs.get('index', None)
+        self.stream_threshold = kwargs.get('stream_threshold', None)
+        self.stream_buffer_mb = kwargs.get('stream_buffer_mb', 8)
+        self.session_fs = kwargs.get('session_fs', None)
+        self.ramp_shape = kwargs.get('ramp_shape', None)
+        self.ramp_dur = kwargs.get('ramp_dur', 0)
+        self._backend = kwargs.get('backend', None)
+        self.stats = None
+        self.streaming = False
 
         # Print message to console
         self.msg = "Begin Audio Event"
@@ -54,6 +92,10 @@ class Audio:
         elif isinstance(audio, np.ndarray):
             print("audiomodel: Found audio ndarray object")
             self.signal = self.audio
+            if self.session_fs and self.fs != self.session_fs:
+                self.signal = dsp.resample(self.signal, self.fs,
+                    self.session_fs)
+                self.fs = self.session_fs
         else:
             print("audiomodel: Unrecognized audio type")
             raise audio_exceptions.InvalidAudioType(type(self.audio))
@@ -74,58 +116,133 @@ class Audio:
         if not file_exists:
             print("audiomodel: Audio file not found!")
             raise FileNotFoundError
+        elif self._is_long_file():
+            # Stream long files instead of loading them
+            print("audiomodel: Long file; streaming during playback")
+            self.streaming = True
+            self.signal = None
+            self.fs = self.info.samplerate
+        elif self.cache is not None:
+            self.signal, self.fs = self.cache.get(self.audio, 
+                self.session_fs)
         else:
-            self.signal, self.fs = sf.read(self.audio)
-            print(f"audiomodel: Sampling rate: {self.fs}")
+            self.signal, self.fs = read_wav(self.audio)
+            if self.session_fs and self.fs != self.session_fs:
+                self.signal = dsp.resample(self.signal, self.fs,
+                    self.session_fs)
+                self.fs = self.session_fs
+        print(f"audiomodel: Sampling rate: {self.fs}")
+
+        # Look up precomputed statistics (these describe the file 
+        # at its own sampling rate, so skip them if resampled)
+        if self.index is not None:
+            self.stats = self.index.get(self.audio)
+            if self.stats is not None and self.stats['fs'] != self.fs:
+                self.stats = None
         
 
+    def _is_long_file(self):
+        """ Check whether the file exceeds the streaming threshold.
+        """
+        if not self.stream_threshold:
+            return False
+        # Cached files are already in memory
+        if (self.cache is not None and 
+            self.cache.peek(self.audio, self.session_fs)):
+            return False
+        self.info = sf.info(self.audio)
+        # Files at another rate are loaded and resampled instead
+        if self.session_fs and self.info.samplerate != self.session_fs:
+            return False
+        return self.info.duration > self.stream_threshold
+
+
     def _get_audio_details(self):
-        # Get number of channels
-        try:
-            self.num_channels = self.signal.shape[1]
-        except IndexError:
-            self.num_channels = 1
+        # Get number of channels and frames
+        if self.streaming:
+            self.num_channels = self.info.channels
+            self.frames = self.info.frames
+        else:
+            try:
+                self.num_channels = self.signal.shape[1]
+            except IndexError:
+                self.num_channels = 1
+            self.frames = len(self.signal)
         self.channels = np.array(range(1, self.num_channels+1))
         print(f"audiomodel: Number of channels in signal: {self.num_channels}")
 
         # Assign audio file attributes
-        self.dur = len(self.signal) / self.fs
-        self.t = np.arange(0, self.dur, 1/self.fs)
+        self.dur = self.frames / self.fs
         print(f"audiomodel: Duration: {np.round(self.dur, 2)} seconds " +
             f"({np.round(self.dur/60, 2)} minutes)")
 
         # Get data type
-        self.data_type = self.signal.dtype
+        if self.streaming:
+            self.data_type = np.dtype(np.float32)
+        else:
+            self.data_type = self.signal.dtype
         print(f"audiomodel: Data type: {self.data_type}")
         print("audiomodel: Done")
 
 
+    @property
+    def backend(self):
+        """ Audio backend (created on first use, so audio can be 
+            loaded and prepared from a registry without PortAudio).
+        """
+        if self._backend is None:
+            self._backend = audiobackend.get_backend()
+        return self._backend
+
+
+    @property
+    def t(self):
+        """ Time base of the signal in seconds (built on demand).
+        """
+        return np.arange(self.frames) / self.fs
+
+
     def stop(self):
         """ Stop audio presentation.
         """
-        sd.stop()
+        self.backend.stop()
+
+
+    def play(self, level=None, device_id=None, routing=None, registry=None):
+        """ Prepare audio for playback and present it using 
+            the backend's play(). 
+        """
+        self.prepare(level=level, device_id=device_id, routing=routing,
+            registry=registry)
+
+        # Present audio
+        print("audiomodel: Attempting to present audio")
+        self.backend.play(self.temp, samplerate=self.fs, 
+            mapping=self.routing, device=self.device_id)
+        print("audiomodel: Done")
+        print('*' * len(self.msg))
 
 
-    def play(self, level=None, device_id=None, routing=None):
+    def prepare(self, level=None, device_id=None, routing=None, 
+        registry=None):
         """ Assign device id. Truncate audio/routing, if necessary,
             based on number of audio device channels. Set level.
+            The prepared buffer is stored in self.temp.
+            registry: an optional deviceregistry.DeviceRegistry used 
+                to look up device details without querying PortAudio
         """
         # Initialization
         self.level = level
         self.device_id = device_id
         self.routing = routing
+        self.registry = registry
 
         print("\naudiomodel: Preparing for playback...")
 
-        # Create a temporary audio file to modify
-        self.temp = self.signal.copy()
-        self.temp = self.temp.astype(np.float32)
-        print(f"audiomodel: Data type converted to {self.temp.dtype}")
-
-        # Assign default sounddevice settings
+        # Look up audio device
         try:
             self._set_defaults()
-        except sd.PortAudioError:
+        except (KeyError, ValueError, self.backend.Error):
             raise audio_exceptions.InvalidAudioDevice(self.device_id)
 
         # Check channel routing
@@ -136,6 +253,10 @@ class Audio:
         # Set level
         self._set_level()
 
+        # Apply onset/offset ramps (never raises the peak)
+        if not self.streaming:
+            self._apply_ramps(self.temp)
+
         # Check for clipping after level has been applied
         try:
             self._check_clipping()
@@ -145,36 +266,27 @@ class Audio:
         # Truncate audio file channels and routing, if necessary, 
         # based on available audio device channels
         self._check_channels_and_routing()
-
-        # Present audio
-        print("audiomodel: Attempting to present audio")
-        sd.play(self.temp, mapping=self.routing)
-        print("audiomodel: Done")
-        print('*' * len(self.msg))
+        print("audiomodel: Ready for playback")
 
 
     #####################
     # Play Helper Funcs #
     #####################
     def _set_defaults(self):
-        """ Set default sounddevice settings based on provided values.
+        """ Look up the audio device details.
         """
-        # Assign audio device default
-        try:
-            sd.default.device = self.device_id
-            print(f"audiomodel: Audio device: " + 
-              f"{sd.query_devices(sd.default.device)['name']}")
-        except sd.PortAudioError:
-            raise
+        # Get audio device details
+        if self.registry is not None:
+            # Use cached device details (KeyError if not cached)
+            device = self.registry.get(self.device_id)
+        else:
+            device = self.backend.query_devices(self.device_id)
+        print(f"audiomodel: Audio device: {device['name']}")
         
         # Get number of available audio device channels
-        self.num_outputs = sd.query_devices(sd.default.device)['max_output_channels']
+        self.num_outputs = device['max_output_channels']
         print(f"audiomodel: Device outputs: {self.num_outputs}")
 
-        # Assign audio device sampling rate based on 
-        # provided audio sampling rate
-        sd.default.samplerate = self.fs
-
 
     def _check_channels_and_routing(self):
         # Check that audio device has enough channels for audio
@@ -186,122 +298,185 @@ class Audio:
             
             # Update audio file and channel routing dimensions to 
             # match number of available audio device outputs
-            self.temp = self.temp[:, 0:self.num_outputs]
-            self.routing = self.routing[:self.temp.shape[1]]
+            # (streamed blocks are truncated during playback)
+            if not self.streaming:
+                self.temp = self.temp[:, 0:self.num_outputs]
+            self.routing = self.routing[:self.num_outputs]
         
-        print(f"audiomodel: Audio shape: {self.temp.shape}")
+        if not self.streaming:
+            print(f"audiomodel: Audio shape: {self.temp.shape}")
+
+
+    def open_stream(self):
+        """ Return a streammodel.BlockStream that applies the 
+            prepared gain to each block.
+        """
+        return streammodel.BlockStream(self.audio, 
+            process=self._process_block, max_mb=self.stream_buffer_mb)
+
+
+    def _process_block(self, block, start):
+        """ Apply prepared DC removal and gain to a streamed block 
+            in place.
+        """
+        if self._dc is not None:
+            np.subtract(block, self._dc, out=block, casting='unsafe')
+        np.multiply(block, self._gain, out=block, casting='unsafe')
+        self._apply_ramps(block, start)
+
+
+    def _apply_ramps(self, buffer, start=0):
+        """ Apply onset/offset ramps to BUFFER (which starts at 
+            frame START of the signal) in place.
+        """
+        dsp.apply_ramps(buffer, self.ramp_shape, self.ramp_dur, self.fs,
+            start=start, total=self.frames)
 
 
     def _set_level(self):  
-        """ Set presentation level and check for clipping.
+        """ Set presentation level and compute the output peak.
+            Writes a single float32 working buffer (self.temp); 
+            the source signal is never modified.
         """
         if self.level == None:
             # Normalize if no level is provided
             print("audiomodel: No level provided; normalizing to +/-1")
-            if self.num_channels > 1:
-                for chan in range(0, self.num_channels):
-                    # Remove DC offset
-                    self.temp[:, chan] = self.temp[:, chan] - np.mean(self.temp[:, chan])
-                    # Normalize
-                    self.temp[:, chan] = self.temp[:, chan] / np.max(np.abs(self.temp[:, chan]))
-                    # account for num channels
-                    self.temp[:, chan] = self.temp[:, chan] / self.num_channels 
-            elif self.num_channels == 1:
-                # Remove DC offset
-                self.temp = self.temp - np.mean(self.temp)
-                # Normalize
-                self.temp = self.temp / np.max(np.abs(self.temp))
-                # account for num channels
-                self.temp = self.temp / 1
         else:
-            # Convert level in dB to magnitude
-            mag = self.db2mag(self.level)
             print(f"audiomodel: Adjusted Level (dB): {self.level}")
-            print(f"audiomodel: Multiplying signal by: {np.round(mag,2)}")
-            # Apply scaling factor to self.temp
-            self.temp = self.temp * mag
+            print("audiomodel: Multiplying signal by: " +
+                f"{np.round(self.db2mag(self.level),2)}")
+
+        if self.streaming:
+            # Gain is applied block by block during playback
+            if self.stats is None:
+                self.stats = stimulusindex.scan_file(self.audio)
+            self.temp = None
+            self._gain, self._dc, self.peak = dsp.plan_gain(
+                self.stats, self.level, self.num_channels)
+        else:
+            # Remove DC/normalize or apply gain in one vectorized stage
+            self.temp, self.peak = dsp.gain_stage(self.signal, self.level,
+                stats=self.stats)
+        self.peak_margin_dB = dsp.peak_margin_dB(self.peak)
+        print("audiomodel: Peak margin (dB): " +
+            f"{np.round(self.peak_margin_dB, 2)}")
 
 
     def _check_clipping(self):
         """ Plot clipped waveform for visual inspection.
         """
-        if np.max(np.abs(self.temp)) > 1:
+        if self.peak > 1:
             # Raise exception to prevent playback
             raise audio_exceptions.Clipping
         
 
     def plot_waveform(self, title=None):
-        """ Plot all channels overlaid.
+        """ Plot all channels overlaid. Long signals are drawn as
+            min/max envelopes (one value pair per pixel); samples 
+            are drawn at full resolution once the view is zoomed 
+            in far enough.
         """
-        # Create time base
-        dur = len(self.temp) / self.fs
-        t = np.arange(0, dur, 1/self.fs)
-        plt.plot(t, self.temp)
-        plt.title(title)
-        plt.xlabel("Time (s)")
-        plt.ylabel("Amplitude")
-        plt.axhline(y=1, color='red', linestyle='--')
-        plt.axhline(y=-1, color='red', linestyle='--')
+        # matplotlib is slow to import and only needed here
+        import matplotlib.pyplot as plt
+        from matplotlib import rcParams
+        rcParams.update({'figure.autolayout': True})
+
+        if self.streaming:
+            # Streamed audio is not held in memory: load it to plot
+            signal, _ = read_wav(self.audio)
+            self.temp, _ = dsp.gain_stage(signal, self.level, out=signal,
+                stats=self.stats)
+            self._apply_ramps(self.temp)
+
+        signal = self.temp.reshape(len(self.temp), -1)
+        fig, ax = plt.subplots()
+        artists = []
+
+        def draw(start, stop):
+            """ Draw frames START to STOP at screen resolution.
+            """
+            for artist in artists:
+                artist.remove()
+            artists.clear()
+
+            pixels = max(int(ax.get_window_extent().width), 1)
+            if stop - start <= 2 * pixels:
+                # Few enough samples to draw them all
+                t = np.arange(start, stop) / self.fs
+                for chan in range(signal.shape[1]):
+                    artists.extend(ax.plot(t, signal[start:stop, chan],
+                        color=f'C{chan}'))
+            else:
+                starts, lo, hi = dsp.minmax_envelope(signal[start:stop],
+                    pixels)
+                t = (starts + start) / self.fs
+                for chan in range(signal.shape[1]):
+                    artists.append(ax.fill_between(t, lo[:, chan],
+                        hi[:, chan], step='post', color=f'C{chan}',
+                        linewidth=0))
+
+        def on_xlim_changed(ax):
+            """ Redraw the visible range after zooming/panning.
+            """
+            t_min, t_max = ax.get_xlim()
+            start = max(int(np.floor(t_min * self.fs)), 0)
+            stop = min(int(np.ceil(t_max * self.fs)) + 1, len(signal))
+            if stop > start:
+                draw(start, stop)
+
+        draw(0, len(signal))
+        ax.set_xlim(0, len(signal) / self.fs)
+        ax.set_autoscalex_on(False)
+        ax.callbacks.connect('xlim_changed', on_xlim_changed)
+
+        ax.set_title(title)
+        ax.set_xlabel("Time (s)")
+        ax.set_ylabel("Amplitude")
+        ax.axhline(y=1, color='red', linestyle='--')
+        ax.axhline(y=-1, color='red', linestyle='--')
         plt.show()
 
 
     ###########################
     # Signal Processing Funcs #
     ###########################
+    # Thin wrappers around the vectorized functions in functions.dsp
     def db2mag(self, db):
         """ 
             Convert decibels to magnitude. Takes a single
-            value or a list of values.
+            value or an array/list of values.
         """
-        # Must use this form to handle negative db values!
-        try:
-            mag = [10**(x/20) for x in db]
-            return mag
-        except:
-            mag = 10**(db/20)
-            return mag
+        return dsp.db2mag(db)
 
 
     def mag2db(self, mag):
         """ 
             Convert magnitude to decibels. Takes a single
-            value or a list of values.
+            value or an array/list of values.
         """
-        try:
-            db = [20 * np.log10(x) for x in mag]
-            return db
-        except:
-            db = 20 * np.log10(mag)
-            return db
+        return dsp.mag2db(mag)
 
 
-    def rms(self, sig):
+    def rms(self, sig, axis=None):
         """ 
-            Calculate the root mean square of a signal. 
-            
-            NOTE: np.square will return invalid, negative 
-                results if the number excedes the bit 
-                depth. In these cases, convert to int64
-                EXAMPLE: sig = np.array(sig,dtype=int)
-
-            Written by: Travis M. Moore
-            Last edited: Feb. 3, 2020
+            Calculate the root mean square of a signal (over all
+            samples, or along AXIS). Computed in float64, so 
+            integer signals do not overflow.
         """
-        theRMS = np.sqrt(np.mean(np.square(sig)))
-        return theRMS
+        return dsp.rms(sig, axis=axis)
 
 
     def setRMS(self, sig, amp, eq='n'):
         """
-            Set RMS level of a 1-channel or 2-channel signal.
+            Set RMS level of an N-channel signal.
         
-            SIG: a 1-channel or 2-channel signal
-            AMP: the desired amplitude to be applied to 
+            SIG: a 1-D signal, or channels x samples array
+            AMP: the desired amplitude (dB) to be applied to 
                 each channel. Note this will be the RMS 
-                per channel, not the total of both channels.
+                per channel, not the total of all channels.
             EQ: takes 'y' or 'n'. Whether or not to equalize 
-                the levels in a 2-channel signal. For example, 
-                a signal with an ILD would lose the ILD with 
+                the levels across channels. For example, a 
+                signal with an ILD would lose the ILD with 
                 EQ='y', so the default in 'n'.
 
             EXAMPLE: 
@@ -310,65 +485,5 @@ class Audio:
             [t, tone2] = mkTone(100,0.1,0,48000)
             combo = np.array([tone1, tone2])
             adjusted = setRMS(combo,-15)
-
-            Written by: Travis M. Moore
-            Created: Jan. 10, 2022
-            Last edited: May 17, 2022
         """
-        if len(sig.shape) == 1:
-            rmsdb = self.mag2db(self.rms(sig))
-            refdb = amp
-            diffdb = np.abs(rmsdb - refdb)
-            if rmsdb > refdb:
-                sigAdj = sig / self.db2mag(diffdb)
-            elif rmsdb < refdb:
-                sigAdj = sig * self.db2mag(diffdb)
-            # Edit 5/17/22
-            # Added handling for when rmsdb == refdb
-            elif rmsdb == refdb:
-                sigAdj = sig
-            return sigAdj
-            
-        elif len(sig.shape) == 2:
-            rmsdbLeft = self.mag2db(self.rms(sig[0]))
-            rmsdbRight = self.mag2db(self.rms(sig[1]))
-
-            ILD = np.abs(rmsdbLeft - rmsdbRight) # get lvl diff
-
-            # Determine lvl advantage
-            if rmsdbLeft > rmsdbRight:
-                lvlAdv = 'left'
-                #print("Adv: %s" % lvlAdv)
-            elif rmsdbRight > rmsdbLeft:
-                lvlAdv = 'right'
-                #print("Adv: %s" % lvlAdv)
-            elif rmsdbLeft == rmsdbRight:
-                lvlAdv = None
-
-            #refdb = amp - 3 # apply half amp to each channel
-            refdb = amp
-            diffdbLeft = np.abs(rmsdbLeft - refdb)
-            diffdbRight = np.abs(rmsdbRight - refdb)
-
-            # Adjust left channel
-            if rmsdbLeft > refdb:
-                sigAdjLeft = sig[0] / self.db2mag(diffdbLeft)
-            elif rmsdbLeft < refdb:
-                sigAdjLeft = sig[0] * self.db2mag(diffdbLeft)
-            # Adjust right channel
-            if rmsdbRight > refdb:
-                sigAdjRight = sig[1] / self.db2mag(diffdbRight)
-            elif rmsdbRight < refdb:
-                sigAdjRight = sig[1] * self.db2mag(diffdbRight)
-
-            # If there is a lvl difference to maintain across channels
-            if eq == 'n':
-                if lvlAdv == 'left':
-                    sigAdjLeft = sigAdjLeft * self.db2mag(ILD/2)
-                    sigAdjRight = sigAdjRight / self.db2mag(ILD/2)
-                elif lvlAdv == 'right':
-                    sigAdjLeft = sigAdjLeft / self.db2mag(ILD/2)
-                    sigAdjRight = sigAdjRight * self.db2mag(ILD/2)
-
-            sigBothAdj = np.array([sigAdjLeft, sigAdjRight])
-            return sigBothAdj
+        return dsp.set_rms(np.asarray(sig), amp, axis=-1, eq=(eq == 'y'))
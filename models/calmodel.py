@@ -57,16 +57,12 @@ class CalModel:
         # This must happen in controller using: self._save_sessionpars()
 
 
-    def calc_level(self, desired_level_dB):
-        # Calculate presentation level
-        self.sessionpars['desired_level_dB'].set(desired_level_dB)
-        scaled_level = desired_level_dB - self.sessionpars['slm_offset'].get()
-        self.sessionpars['adjusted_level_dB'].set(scaled_level)
-        print(f"\ncalmodel: Desired level in dB: " +
-              f"{self.sessionpars['desired_level_dB'].get()}")
-        print(f"calmodel: SLM offset: {self.sessionpars['slm_offset'].get()}")
-        print(f"calmodel: Adjusted level (dB): " +
-            f"{self.sessionpars['adjusted_level_dB'].get()}")
-
-        # Calculated level not yet saved! 
-        # This must happen in controller using: self._save_sessionpars()
+    def adjusted_level(self, desired_level_dB, slm_offset=None):
+        """ Return the dB FS level for DESIRED_LEVEL_DB without
+            updating sessionpars. Accepts a single value or an 
+            array of values. SLM_OFFSET defaults to the current
+            sessionpars value.
+        """
+        if slm_offset is None:
+            slm_offset = self.sessionpars['slm_offset'].get()
+        return desired_level_dB - slm_offset
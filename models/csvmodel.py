@@ -1,4 +1,16 @@
 """ Class to write data to .csv
+
+    The data file is opened on the first record and kept open for
+    the session, with a single csv.DictWriter. Rows are flushed 
+    according to the flush policy (every N records and/or every N 
+    seconds) and fsync'd at the end of a block and on close.
+
+    The flush policy only applies when the .csv file is written 
+    during the task, i.e., with the trial journal turned off. With 
+    the journal on (the default), every record reaches the OS as 
+    soon as it is journaled and the journal is fsync'd at the end of
+    each block; the .csv file is written once, when the session 
+    ends (see journalmodel).
 """
 
 ############
@@ -6,6 +18,7 @@
 ############
 # Import system packages
 import csv
+import time
 from pathlib import Path
 from datetime import datetime
 import os
@@ -26,6 +39,17 @@ class CSVModel:
         # Generate date stamp
         self.datestamp = datetime.now().strftime("%Y_%b_%d_%H%M")
 
+        # Open data file and writer (created on the first record)
+        self.file = None
+        self._fh = None
+        self._writer = None
+
+        # Flush policy
+        self.flush_records = 1
+        self.flush_seconds = 0
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
         # Check for existing data directory
         self._check_dir()
 
@@ -60,16 +84,77 @@ class CSVModel:
             raise PermissionError(msg)
 
 
-    def save_record(self, data):
-        """ Save a dictionary of data to .csv file 
+    def set_flush_policy(self, records=1, seconds=0):
+        """ Flush buffered rows to the file after every RECORDS 
+            records and/or when SECONDS have passed since the last 
+            flush (checked as records are saved). 0 disables either
+            rule; with both disabled, rows are written at the end 
+            of each block.
+        """
+        self.flush_records = records
+        self.flush_seconds = seconds
+        print(f"\ncsvmodel: Flushing every {records or '-'} record(s) / " +
+            f"{seconds or '-'} s")
+
+
+    def _open(self, data):
+        """ Check access, open the data file and create the writer 
+            using the keys of the first record DATA.
         """
         self._create_file(data['subject'], data['condition'])
-        
-        # Write file
+
         newfile = not self.file.exists()
-        with open(self.file, 'a', newline='') as fh:
-            csvwriter = csv.DictWriter(fh, fieldnames=data.keys())
-            if newfile:
-                csvwriter.writeheader()
-            csvwriter.writerow(data)
+        self._fh = open(self.file, 'a', newline='')
+        self._writer = csv.DictWriter(self._fh, fieldnames=list(data))
+        if newfile:
+            self._writer.writeheader()
+        self._last_flush = time.monotonic()
+
+
+    def save_record(self, data):
+        """ Save a dictionary of data to .csv file 
+        """
+        if self._fh is None:
+            self._open(data)
+
+        # Write row
+        self._writer.writerow(data)
+        self._pending += 1
+        if (
+            (self.flush_records and self._pending >= self.flush_records) or
+            (self.flush_seconds and 
+                time.monotonic() - self._last_flush >= self.flush_seconds)
+        ):
+            self.flush()
         print("\ncsvmodel: Record successfully saved!")
+
+
+    def flush(self, sync=False):
+        """ Write buffered rows to the file. If SYNC, also ask the
+            OS to write them to disk.
+        """
+        if self._fh is None:
+            return
+        self._fh.flush()
+        if sync:
+            os.fsync(self._fh.fileno())
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+
+    def end_block(self):
+        """ Flush and sync all rows at the end of a block.
+        """
+        self.flush(sync=True)
+
+
+    def close(self):
+        """ Flush, sync and close the data file.
+        """
+        if self._fh is None:
+            return
+        self.end_block()
+        self._fh.close()
+        self._fh = None
+        self._writer = None
+        print("\ncsvmodel: Data file closed")
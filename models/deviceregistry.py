@@ -0,0 +1,140 @@
+""" Registry of audio device information.
+
+    Audio devices are enumerated once in a background thread and
+    cached. The cached list is only rebuilt when a refresh is
+    requested (e.g., from the Audio Settings dialog, or after a
+    device error). To see devices that were plugged in or removed,
+    refresh with rescan=True after closing all streams: the backend
+    is reinitialized first.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import threading
+
+# Import custom modules
+from models import audiobackend
+
+
+#########
+# BEGIN #
+#########
+class DeviceRegistry:
+    """ Background-enumerated cache of audio device metadata.
+    """
+    # Sampling rates to probe for each output device
+    SAMPLE_RATES = (22050, 44100, 48000, 88200, 96000, 192000)
+
+    # Longest time get() waits for enumeration (seconds)
+    TIMEOUT_S = 5.0
+
+    def __init__(self, backend=None):
+        # Audio backend (sounddevice by default)
+        self.backend = backend or audiobackend.get_backend()
+
+        # Cached devices: device id -> device info dict
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+
+
+    def refresh(self, blocking=False, rescan=False):
+        """ Enumerate devices in a background thread. If an
+            enumeration is already running, do not start another.
+            If RESCAN, the backend is reinitialized first so device
+            changes are detected (close all streams beforehand, 
+            e.g., with audioengine.AudioEngine.close()).
+        """
+        if self._thread is None or not self._thread.is_alive():
+            print("\ndeviceregistry: Enumerating audio devices...")
+            self._ready.clear()
+            self._thread = threading.Thread(
+                target=self._enumerate, args=(rescan,), daemon=True)
+            self._thread.start()
+
+        if blocking:
+            self.wait()
+
+
+    def wait(self, timeout=None):
+        """ Wait for enumeration to finish. Return True if the
+            device list is available.
+        """
+        if self._thread is None:
+            self.refresh()
+        return self._ready.wait(timeout)
+
+
+    def get(self, device_id, timeout=TIMEOUT_S):
+        """ Return the info dict for DEVICE_ID. Raise KeyError
+            if the device does not exist (or enumeration did not 
+            finish within TIMEOUT seconds).
+        """
+        if not self.wait(timeout):
+            print("deviceregistry: Timed out waiting for devices")
+        with self._lock:
+            return self._devices[device_id]
+
+
+    def output_devices(self):
+        """ Return a list of info dicts for devices with outputs.
+        """
+        with self._lock:
+            return [dev for dev in self._devices.values()
+                if dev['max_output_channels'] > 0]
+
+
+    def _enumerate(self, rescan=False):
+        """ Query the backend for all devices and cache the results.
+        """
+        devices = dict()
+        try:
+            if rescan:
+                print("deviceregistry: Reinitializing audio backend...")
+                self.backend.reinitialize()
+            device_list = self.backend.query_devices()
+            hostapis = self.backend.query_hostapis()
+            for ii, dev in enumerate(device_list):
+                devices[ii] = {
+                    'id': ii,
+                    'name': dev['name'],
+                    'hostapi': hostapis[dev['hostapi']]['name'],
+                    'max_output_channels': dev['max_output_channels'],
+                    'default_low_output_latency':
+                        dev['default_low_output_latency'],
+                    'default_high_output_latency':
+                        dev['default_high_output_latency'],
+                    'default_samplerate': dev['default_samplerate'],
+                    'samplerates': self._probe_samplerates(ii, dev)
+                }
+        except self.backend.Error as e:
+            print(f"deviceregistry: Device enumeration failed: {e}")
+        except Exception as e:
+            # E.g., a missing field or a driver error: keep the 
+            # devices found so far rather than leave get() waiting
+            print(f"deviceregistry: Device enumeration failed: {e!r}")
+        finally:
+            with self._lock:
+                self._devices = devices
+            self._ready.set()
+            print(f"deviceregistry: Found {len(devices)} audio device(s)")
+
+
+    def _probe_samplerates(self, device_id, dev):
+        """ Return the supported output sampling rates for a device.
+        """
+        if dev['max_output_channels'] < 1:
+            return []
+
+        rates = []
+        for rate in self.SAMPLE_RATES:
+            try:
+                self.backend.check_output_settings(device=device_id,
+                    samplerate=rate)
+                rates.append(rate)
+            except (self.backend.Error, ValueError):
+                pass
+        return rates
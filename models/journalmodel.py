@@ -0,0 +1,172 @@
+""" Crash-safe trial journal.
+
+    Trial records are appended to a line-delimited journal file
+    while the task runs. Each line is a CRC-32 checksum followed by
+    a JSON record and is written with a single os.write() call on
+    a file opened in append mode, so a crash can at worst leave one
+    partial line, which fails its checksum and is ignored.
+
+    The first line is a header holding the session details and the
+    full (randomized) trial order, so the exact sequence of trials
+    can be rebuilt from the journal. When the session ends, the
+    journal is compacted into the final .csv file and removed.
+    Journals left behind by a crash are recovered the same way.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import os
+import csv
+import json
+import zlib
+from pathlib import Path
+
+# Import custom modules
+from functions import general
+
+
+#########
+# Funcs #
+#########
+def encode(record):
+    """ Return RECORD as one checksummed journal line (bytes).
+    """
+    payload = json.dumps(record, 
+        default=general.json_default).encode('utf-8')
+    return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
+
+def decode(line):
+    """ Return the record in a journal LINE, or None if the line is
+        incomplete or fails its checksum.
+    """
+    try:
+        crc, payload = line.rstrip(b'\n').split(b' ', 1)
+        if not line.endswith(b'\n') or int(crc, 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+def read_journal(path):
+    """ Read a journal. Returns (header, records), where records
+        are the trial data dicts in the order they were written.
+        Reading stops at the first damaged line.
+    """
+    header = None
+    records = []
+    with open(path, 'rb') as fh:
+        for number, line in enumerate(fh, start=1):
+            entry = decode(line)
+            if entry is None:
+                print(f"journalmodel: Ignoring damaged line {number} " +
+                    f"in {os.path.basename(path)}")
+                break
+            if entry['type'] == 'header':
+                header = entry
+            elif entry['type'] == 'trial':
+                records.append(entry['data'])
+    return header, records
+
+
+def compact(path):
+    """ Append the trial records in the journal at PATH to the .csv
+        file with the same name, sync it to disk and remove the
+        journal. Returns (csv_path, header, records).
+    """
+    header, records = read_journal(path)
+    csv_path = Path(path).with_suffix('.csv')
+
+    if records:
+        newfile = not csv_path.exists()
+        with open(csv_path, 'a', newline='') as fh:
+            writer = csv.DictWriter(fh, fieldnames=list(records[0]))
+            if newfile:
+                writer.writeheader()
+            writer.writerows(records)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    os.remove(path)
+    print(f"journalmodel: Compacted {len(records)} record(s) into " +
+        f"{csv_path.name}")
+    return csv_path, header, records
+
+
+def find_journals(directory):
+    """ Return journals left in DIRECTORY (e.g., after a crash).
+    """
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+    return sorted(directory.glob('*' + TrialJournal.SUFFIX))
+
+
+#########
+# BEGIN #
+#########
+class TrialJournal:
+    """ Append-only journal of trial records for one session.
+    """
+    SUFFIX = '.journal'
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = Path(path)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        # Binary mode on Windows (no newline translation)
+        flags |= getattr(os, 'O_BINARY', 0)
+        self._fd = os.open(self.path, flags, 0o644)
+        print(f"\njournalmodel: Writing trial journal to {self.path}")
+
+
+    def _write(self, record):
+        """ Append RECORD with a single write call.
+        """
+        os.write(self._fd, encode(record))
+
+
+    def write_header(self, session, columns, trials):
+        """ Record the session details (dict), the trial matrix
+            COLUMNS and the TRIALS (rows of the matrix in
+            presentation order).
+        """
+        self._write({
+            'type': 'header',
+            'version': self.VERSION,
+            'session': session,
+            'columns': list(columns),
+            'trials': [list(row) for row in trials]
+        })
+
+
+    def append(self, data):
+        """ Record the data dict for one trial.
+        """
+        self._write({'type': 'trial', 'data': data})
+
+
+    def sync(self):
+        """ Ask the OS to write the journal to disk (records reach
+            the OS on every append; this guards against power loss).
+        """
+        if self._fd is not None:
+            os.fsync(self._fd)
+
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+    def compact(self):
+        """ Close the journal and compact it into the .csv file.
+            Returns the path to the .csv file.
+        """
+        self.close()
+        csv_path, _, _ = compact(self.path)
+        return csv_path
@@ -0,0 +1,67 @@
+""" Continuous background masker.
+
+    The masker file is decoded once, scaled to its calibrated level
+    and looped by the audio engine underneath the trial stimuli, so
+    the masker does not have to be mixed into every stimulus file.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import os
+
+# Import custom modules
+from exceptions import audio_exceptions
+from functions import dsp
+from models import audiomodel
+
+
+#########
+# BEGIN #
+#########
+class Masker:
+    """ Scaled masker buffers, one per sampling rate.
+    """
+    def __init__(self, path, level_dB, cache=None):
+        """ path: masker audio file
+            level_dB: calibrated (adjusted) level in dB
+            cache: optional stimuluscache.StimulusCache
+        """
+        self.path = path
+        self.level = level_dB
+        self.cache = cache
+        self.peak = None
+
+        # Scaled buffers: sampling rate -> buffer
+        self._buffers = dict()
+
+
+    def buffer(self, fs=None):
+        """ Return the scaled masker at FS (the file's own rate if
+            None). Raises audio_exceptions.Clipping if the scaled
+            masker exceeds full scale.
+        """
+        if fs in self._buffers:
+            return self._buffers[fs]
+
+        print(f"\nmaskermodel: Loading {os.path.basename(self.path)}...")
+        if self.cache is not None:
+            signal, file_fs = self.cache.get(self.path, fs)
+        else:
+            signal, file_fs = audiomodel.read_wav(self.path)
+            if fs and fs != file_fs:
+                signal = dsp.resample(signal, file_fs, fs)
+                file_fs = fs
+
+        buffer, self.peak = dsp.gain_stage(signal, self.level)
+        print(f"maskermodel: Level (dB): {self.level}")
+        print("maskermodel: Peak margin (dB): " +
+            f"{dsp.peak_margin_dB(self.peak):.2f}")
+        if self.peak > 1:
+            raise audio_exceptions.Clipping
+
+        # Shared with the audio callback: keep it read-only
+        buffer.flags.writeable = False
+        self._buffers[fs] = self._buffers[file_fs] = buffer
+        return buffer
@@ -0,0 +1,96 @@
+""" Background preparation of the next trial's audio.
+
+    While the participant is responding to the current trial, the
+    next trial's stimulus is loaded, scaled and checked for clipping
+    on a worker thread (soundfile and NumPy release the GIL), so the
+    next presentation only has to hand a ready buffer to the audio
+    engine.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# Import custom modules
+from models import audiomodel
+
+
+#########
+# BEGIN #
+#########
+class TrialPrefetcher:
+    """ Prepare audiomodel.Audio objects ahead of time.
+    """
+    def __init__(self, registry=None, **kwargs):
+        """ registry: deviceregistry.DeviceRegistry for device details
+            kwargs: passed to audiomodel.Audio (e.g., cache, index)
+        """
+        self.registry = registry
+        self.audio_kwargs = kwargs
+
+        # A single worker keeps prefetches in trial order
+        self._executor = ThreadPoolExecutor(max_workers=1,
+            thread_name_prefix='prefetch')
+
+        # Pending prefetch: (trial, request) -> future
+        self._pending = dict()
+
+
+    def submit(self, trial, audio, level, device_id, routing):
+        """ Start preparing AUDIO for TRIAL in the background.
+            LEVEL is the calibrated (adjusted) level in dB.
+        """
+        request = (str(audio), float(level), device_id, tuple(routing))
+        print(f"\nprefetchmodel: Prefetching trial {trial+1}")
+
+        # Only the next trial is kept
+        self.cancel()
+        self._pending[(trial, request)] = self._executor.submit(
+            self._prepare, Path(audio), level, device_id, list(routing))
+
+
+    def take(self, trial, audio, level, device_id, routing):
+        """ Return the prepared Audio object for TRIAL, waiting for
+            it to finish if necessary. Returns None if nothing
+            matching was prefetched or preparation failed (the
+            caller then prepares the audio itself, which reports
+            the error).
+        """
+        request = (str(audio), float(level), device_id, tuple(routing))
+        future = self._pending.pop((trial, request), None)
+        self.cancel()
+        if future is None:
+            return None
+
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"prefetchmodel: Prefetch failed: {e!r}")
+            return None
+
+
+    def cancel(self):
+        """ Discard any pending prefetch.
+        """
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+
+    def shutdown(self):
+        """ Stop the worker thread.
+        """
+        self.cancel()
+        self._executor.shutdown(wait=False)
+
+
+    def _prepare(self, audio, level, device_id, routing):
+        """ Load, scale and clipping-check a stimulus (worker thread).
+        """
+        a = audiomodel.Audio(audio=audio, **self.audio_kwargs)
+        a.prepare(level=level, device_id=device_id, routing=routing,
+            registry=self.registry)
+        return a
@@ -0,0 +1,99 @@
+""" Background writer for trial records.
+
+    Records are put on a bounded queue and written by a worker
+    thread, so a slow disk or network share never blocks the Tk
+    event loop. When the queue is full, put() waits for the writer
+    (backpressure) instead of using more memory. Write errors are
+    kept for the GUI thread to collect with errors(). Other work
+    that must follow the queued records (e.g., syncing the file at
+    the end of a block) can be queued with call().
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import queue
+import threading
+
+
+#########
+# BEGIN #
+#########
+class RecordSink:
+    """ Write records on a worker thread.
+    """
+    def __init__(self, write, maxsize=256):
+        """ write: function that saves one record (called on the
+                worker thread, e.g., csvmodel.CSVModel.save_record)
+            maxsize: maximum number of queued records
+        """
+        self.write = write
+        self._queue = queue.Queue(maxsize)
+        self._errors = queue.Queue()
+
+        self._thread = threading.Thread(target=self._run,
+            name='recordsink', daemon=True)
+        self._thread.start()
+
+
+    def put(self, record):
+        """ Queue RECORD for writing. Blocks while the queue is full.
+        """
+        self.call(self.write, record)
+
+
+    def call(self, func, *args):
+        """ Queue FUNC(*ARGS) to run on the worker thread after the
+            records already queued. Blocks while the queue is full.
+        """
+        if self._queue.full():
+            print("recordsink: Queue full; waiting for the writer...")
+        self._queue.put((func, args))
+
+
+    def errors(self):
+        """ Return (and clear) the exceptions raised while writing
+            since the last call.
+        """
+        errors = []
+        while True:
+            try:
+                errors.append(self._errors.get_nowait())
+            except queue.Empty:
+                return errors
+
+
+    def drain(self):
+        """ Wait until every queued record has been written.
+        """
+        if self._queue.unfinished_tasks:
+            print("recordsink: Waiting for queued records to be written...")
+        self._queue.join()
+
+
+    def close(self):
+        """ Write any queued records and stop the worker thread.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+
+    def _run(self):
+        """ Write queued records (worker thread).
+        """
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                func, args = item
+                func(*args)
+            except Exception as e:
+                print(f"recordsink: Write failed: {e!r}")
+                self._errors.put(e)
+            finally:
+                self._queue.task_done()
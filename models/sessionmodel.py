@@ -7,6 +7,7 @@
 # Import system packages
 from pathlib import Path
 import os
+import tempfile
 
 # Import data handling packages
 import json
@@ -23,14 +24,37 @@ class SessionParsModel:
         'condition': {'type': 'str', 'value': 'TEST'},
         'randomize': {'type': 'int', 'value': 0},
         'repetitions': {'type': 'int', 'value': 1},
+        'timing_log': {'type': 'int', 'value': 0},
+        'flush_records': {'type': 'int', 'value': 1},
+        'flush_seconds': {'type': 'float', 'value': 0.0},
+        'journal': {'type': 'int', 'value': 1},
+        'sqlite_store': {'type': 'int', 'value': 0},
 
         # Stimulus variables
         'audio_files_dir': {'type': 'str', 'value': 'Please select a folder'},
         'matrix_file_path': {'type': 'str', 'value': 'Please select a file'},
+        'stim_cache_mb': {'type': 'int', 'value': 512},
+        'stream_threshold_s': {'type': 'float', 'value': 60.0},
+        'stream_buffer_mb': {'type': 'int', 'value': 8},
+        'ramp_shape': {'type': 'str', 'value': 'none'},
+        'ramp_dur_ms': {'type': 'float', 'value': 10.0},
+
+        # Background masker variables
+        'masker_file': {'type': 'str', 'value': ''},
+        'masker_level_dB': {'type': 'float', 'value': 65.0},
+        'target_delay_ms': {'type': 'float', 'value': 0.0},
 
         # Audio device variables
+        'audio_backend': {'type': 'str', 'value': 'sounddevice'},
         'audio_device': {'type': 'int', 'value': 999},
         'channel_routing': {'type': 'str', 'value': '1'},
+        'session_fs': {'type': 'int', 'value': 0},
+
+        # Latency profile variables
+        'latency': {'type': 'str', 'value': 'low'},
+        'blocksize': {'type': 'int', 'value': 0},
+        'dither_off': {'type': 'int', 'value': 0},
+        'wasapi_exclusive': {'type': 'int', 'value': 0},
 
         # Calibration variables
         'cal_file': {'type': 'str', 'value': 'cal_stim.wav'},
@@ -67,6 +91,9 @@ class SessionParsModel:
         # Path to file
         self.filepath = directory / filename
 
+        # Fields changed since the last save
+        self._dirty = set()
+
         # Attempt to load session parameters file
         self.load()
 
@@ -79,6 +106,8 @@ class SessionParsModel:
         if not self.filepath.exists():
             print("sessionmodel: No session parameters file found; " +
                   "using default values")
+            # Write the defaults on the first save
+            self._dirty = set(self.fields)
             return
 
         # Open the file and read in the raw values
@@ -102,12 +131,40 @@ class SessionParsModel:
 
 
     def save(self):
-        """ Save current session parameters to file 
+        """ Save current session parameters to file if any have 
+            changed since the last save. The file is written to a 
+            temporary file and renamed, so an interrupted save 
+            never leaves a truncated file. Returns True if the file
+            was written.
         """
+        if not self._dirty:
+            return False
+
         # Write to JSON file
         #print("sessionmodel: Writing session pars from model to file...")
-        with open(self.filepath, 'w') as fh:
-            json.dump(self.fields, fh)
+        fd, temp = tempfile.mkstemp(dir=self.filepath.parent, 
+            prefix='.config_', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(self.fields, fh)
+            os.replace(temp, self.filepath)
+        except BaseException:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            raise
+        print(f"sessionmodel: Saved {len(self._dirty)} changed " +
+            "parameter(s)")
+        self._dirty.clear()
+        return True
+
+
+    @property
+    def dirty(self):
+        """ True if there are unsaved changes.
+        """
+        return bool(self._dirty)
 
 
     def set(self, key, value):
@@ -119,6 +176,53 @@ class SessionParsModel:
             key in self.fields and 
             type(value).__name__ == self.fields[key]['type']
         ):
-            self.fields[key]['value'] = value
+            if self.fields[key]['value'] != value:
+                self.fields[key]['value'] = value
+                self._dirty.add(key)
         else:
             raise ValueError("sessionmodel: Bad key or wrong variable type")
+
+
+class SessionSnapshot:
+    """ Immutable copy of the session parameters.
+
+        Taken once when the task starts and passed to the models in 
+        place of the Tk variables, so the trial loop reads plain
+        attributes (e.g., snapshot.subject or snapshot['subject']) 
+        instead of calling into Tcl, and the models can run 
+        without Tk.
+    """
+    __slots__ = tuple(SessionParsModel.fields)
+
+    # Field types (see SessionParsModel.fields)
+    _TYPES = {'bool': bool, 'str': str, 'int': int, 'float': float}
+
+    def __init__(self, values):
+        for key in self.__slots__:
+            cast = self._TYPES[SessionParsModel.fields[key]['type']]
+            object.__setattr__(self, key, cast(values[key]))
+
+
+    @classmethod
+    def from_vars(cls, sessionpars):
+        """ Create a snapshot from a dict of Tk variables.
+        """
+        return cls({key: var.get() for key, var in sessionpars.items()})
+
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Session snapshots are read-only")
+
+
+    def __delattr__(self, key):
+        raise AttributeError("Session snapshots are read-only")
+
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
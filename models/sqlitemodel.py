@@ -0,0 +1,304 @@
+""" Optional SQLite store for session and trial data.
+
+    Written alongside the .csv files (not instead of them), so one
+    database holds every session and can be queried by subject,
+    condition or stimulus without parsing a .csv file per session.
+
+    Tables:
+        sessions: one row per session (subject, condition, date
+            stamp, app version and all session parameters as JSON)
+        trials: one row per trial, with the common columns and the
+            full trial record as JSON
+        calibration: calibration values used for each session
+
+    The database uses WAL mode, and trial rows are inserted in
+    batches. Existing .csv files can be added with import_csv().
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import csv
+import json
+import sqlite3
+from pathlib import Path
+
+# Import custom modules
+from functions import general
+
+
+#############
+# Constants #
+#############
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    subject TEXT NOT NULL,
+    condition TEXT NOT NULL,
+    datestamp TEXT NOT NULL,
+    app_version TEXT,
+    params TEXT,
+    UNIQUE (subject, condition, datestamp)
+);
+CREATE TABLE IF NOT EXISTS trials (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    trial INTEGER,
+    stimulus TEXT,
+    desired_level_dB REAL,
+    adjusted_level_dB REAL,
+    expected_resp TEXT,
+    actual_resp INTEGER,
+    resp_type TEXT,
+    data TEXT
+);
+CREATE TABLE IF NOT EXISTS calibration (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    cal_file TEXT,
+    cal_level_dB REAL,
+    slm_reading REAL,
+    slm_offset REAL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_subject ON sessions (subject);
+CREATE INDEX IF NOT EXISTS idx_sessions_condition ON sessions (condition);
+CREATE INDEX IF NOT EXISTS idx_trials_session ON trials (session_id);
+CREATE INDEX IF NOT EXISTS idx_trials_stimulus ON trials (stimulus);
+"""
+
+# Trial record keys stored in their own columns
+TRIAL_COLUMNS = ('trial', 'stimulus', 'desired_level_dB',
+    'adjusted_level_dB', 'expected_resp', 'actual_resp', 'resp_type')
+INSERT_TRIAL = 'INSERT INTO trials (session_id, ' + \
+    ', '.join(TRIAL_COLUMNS) + ', data) VALUES (' + \
+    ', '.join('?' * (len(TRIAL_COLUMNS) + 2)) + ')'
+
+# Calibration values stored per session
+CAL_COLUMNS = ('cal_file', 'cal_level_dB', 'slm_reading', 'slm_offset')
+
+
+#########
+# Funcs #
+#########
+def _value(value):
+    """ Convert NumPy scalars for sqlite3.
+    """
+    return value.item() if hasattr(value, 'item') else value
+
+
+#########
+# BEGIN #
+#########
+class SQLiteModel:
+    """ Store sessions and trials in an SQLite database.
+    """
+    FILENAME = 'yes_no.sqlite'
+
+    def __init__(self, path, batch_size=50):
+        """ path: database file (created if needed)
+            batch_size: number of trial rows per insert
+        """
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.session_id = None
+        self._pending = []
+
+        # Records are written by the record sink's worker thread,
+        # one at a time, after the session is started here
+        self.con = sqlite3.connect(self.path, check_same_thread=False)
+        self.con.execute('PRAGMA journal_mode=WAL')
+        self.con.execute('PRAGMA synchronous=NORMAL')
+        self.con.execute('PRAGMA foreign_keys=ON')
+        with self.con:
+            self.con.executescript(SCHEMA)
+        print(f"\nsqlitemodel: Using database {self.path}")
+
+
+    ###########
+    # Writing #
+    ###########
+    def start_session(self, session, datestamp, app_version=None):
+        """ Add a session (SESSION: dict of session parameters,
+            e.g., SessionSnapshot.as_dict()) and its calibration
+            values. Trial records saved afterwards belong to it.
+        """
+        self.flush()
+        self.session_id = self._add_session(session['subject'],
+            session['condition'], datestamp, app_version, session)
+        self.con.commit()
+        return self.session_id
+
+
+    def _add_session(self, subject, condition, datestamp, app_version,
+        params):
+        """ Insert (or find) a session and its calibration row.
+            Returns the session id.
+        """
+        cur = self.con.execute(
+            'INSERT OR IGNORE INTO sessions (subject, condition, ' +
+            'datestamp, app_version, params) VALUES (?, ?, ?, ?, ?)',
+            (str(subject), str(condition), datestamp, app_version,
+                json.dumps(params, default=general.json_default))
+        )
+        if not cur.rowcount:
+            return self.con.execute(
+                'SELECT id FROM sessions WHERE subject = ? AND ' +
+                'condition = ? AND datestamp = ?',
+                (str(subject), str(condition), datestamp)
+            ).fetchone()[0]
+
+        session_id = cur.lastrowid
+        self.con.execute(
+            'INSERT INTO calibration (session_id, ' +
+            ', '.join(CAL_COLUMNS) + ') VALUES (?, ?, ?, ?, ?)',
+            (session_id, *[_value(params.get(key)) for key in CAL_COLUMNS])
+        )
+        return session_id
+
+
+    def _trial_row(self, session_id, data):
+        return (
+            session_id,
+            *[_value(data.get(key)) for key in TRIAL_COLUMNS],
+            json.dumps(data, default=general.json_default)
+        )
+
+
+    def save_record(self, data):
+        """ Queue a trial record; rows are inserted in batches.
+        """
+        if self.session_id is None:
+            raise RuntimeError("sqlitemodel: No session started")
+        self._pending.append(self._trial_row(self.session_id, data))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+
+    def flush(self):
+        """ Insert queued trial rows in one transaction.
+        """
+        if not self._pending:
+            return
+        with self.con:
+            self.con.executemany(
+                INSERT_TRIAL,
+                self._pending
+            )
+        print(f"\nsqlitemodel: Inserted {len(self._pending)} trial(s)")
+        self._pending = []
+
+
+    def import_csv(self, paths):
+        """ Add existing .csv data files (named subject_condition_
+            datestamp.csv). Files already in the database are
+            skipped. Returns the number of files added.
+        """
+        added = 0
+        for path in paths:
+            path = Path(path)
+            with open(path, newline='') as fh:
+                rows = list(csv.DictReader(fh))
+            if not rows:
+                continue
+
+            # The date stamp is the last 4 parts of the file name
+            datestamp = '_'.join(path.stem.split('_')[-4:])
+            first = rows[0]
+            exists = self.con.execute(
+                'SELECT 1 FROM sessions WHERE subject = ? AND ' +
+                'condition = ? AND datestamp = ?',
+                (first['subject'], first['condition'], datestamp)
+            ).fetchone()
+            if exists:
+                continue
+
+            with self.con:
+                session_id = self._add_session(first['subject'],
+                    first['condition'], datestamp, None, first)
+                self.con.executemany(
+                    INSERT_TRIAL,
+                    [self._trial_row(session_id, row) for row in rows]
+                )
+            added += 1
+        print(f"\nsqlitemodel: Imported {added} file(s)")
+        return added
+
+
+    def close(self):
+        """ Insert any queued rows and close the database.
+        """
+        if self.con is None:
+            return
+        self.flush()
+        self.con.close()
+        self.con = None
+        print("\nsqlitemodel: Database closed")
+
+
+    ###########
+    # Reading #
+    ###########
+    def _select(self, table, subject=None, condition=None, stimulus=None):
+        """ Build a query on TABLE filtered by the given values.
+        """
+        query = {
+            'sessions': 'SELECT s.* FROM sessions s',
+            'calibration': 'SELECT s.subject, s.condition, s.datestamp, ' +
+                'c.* FROM calibration c JOIN sessions s ' +
+                'ON s.id = c.session_id',
+            'trials': 'SELECT s.subject, s.condition, s.datestamp, ' +
+                't.* FROM trials t JOIN sessions s ON s.id = t.session_id'
+        }[table]
+        where = []
+        params = []
+        for column, value in (('s.subject', subject),
+            ('s.condition', condition), ('t.stimulus', stimulus)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        return query, params
+
+
+    def query(self, sql, params=(), as_frame=True):
+        """ Run SQL and return the result as a DataFrame or, if not
+            AS_FRAME, a dict of column name -> NumPy array.
+        """
+        self.flush()
+        cur = self.con.execute(sql, params)
+        columns = [desc[0] for desc in cur.description]
+        rows = cur.fetchall()
+        if as_frame:
+            import pandas as pd
+            return pd.DataFrame.from_records(rows, columns=columns)
+        return {name: np.array([row[ii] for row in rows])
+            for ii, name in enumerate(columns)}
+
+
+    def sessions(self, subject=None, condition=None, as_frame=True):
+        """ Sessions, optionally for one subject and/or condition.
+        """
+        return self.query(*self._select('sessions', subject, condition),
+            as_frame=as_frame)
+
+
+    def trials(self, subject=None, condition=None, stimulus=None,
+        as_frame=True):
+        """ Trials (with subject, condition and date stamp),
+            optionally for one subject, condition and/or stimulus.
+        """
+        sql, params = self._select('trials', subject, condition, stimulus)
+        return self.query(sql + ' ORDER BY t.session_id, t.trial', params,
+            as_frame=as_frame)
+
+
+    def calibration(self, subject=None, condition=None, as_frame=True):
+        """ Calibration values per session.
+        """
+        return self.query(*self._select('calibration', subject, condition),
+            as_frame=as_frame)
@@ -0,0 +1,173 @@
+""" Session-wide cache of decoded stimulus files.
+
+    Decoded audio is stored in memory, keyed by file path,
+    modification time, size and (optionally) the sampling rate it 
+    was resampled to, so that each .wav file is only read and 
+    resampled once per session (unless it changes on disk).
+    The least recently used entries are evicted when the total
+    size of the cached arrays exceeds the memory budget.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import os
+import threading
+from collections import OrderedDict
+
+# Import audio packages
+import soundfile as sf
+
+# Import custom modules
+from models import audiomodel
+from functions import dsp
+
+
+#########
+# BEGIN #
+#########
+class StimulusCache:
+    """ LRU cache of decoded audio arrays with a memory budget.
+    """
+    def __init__(self, budget_mb=512):
+        # Memory budget in bytes
+        self.budget = int(budget_mb * 1024 * 1024)
+
+        # Cached entries: (path, mtime, size, fs) -> (signal, fs)
+        self._entries = OrderedDict()
+        self.nbytes = 0
+
+        # Cache may be used by the prefetch thread
+        self._lock = threading.RLock()
+
+        # Usage counters
+        self.hits = 0
+        self.misses = 0
+
+
+    def _make_key(self, path, fs=None):
+        """ Build cache key from file path, mtime, size and target
+            sampling rate (None for the file's own rate).
+        """
+        path = os.path.abspath(path)
+        try:
+            stats = os.stat(path)
+        except FileNotFoundError:
+            print(f"stimuluscache: {os.path.basename(path)} not found!")
+            raise
+        return (path, stats.st_mtime_ns, stats.st_size, fs)
+
+
+    def get(self, path, fs=None, on_decode=None):
+        """ Return (signal, fs) for the file at PATH, decoding it
+            and adding it to the cache if necessary. If FS is given,
+            the signal is resampled to FS. ON_DECODE(path, signal, 
+            fs) is called with the decoded signal at the file's own
+            rate (before resampling) when the file is read.
+        """
+        key = self._make_key(path, fs)
+
+        with self._lock:
+            # Cache hit: mark as most recently used
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        # Cache miss: decode (and resample) file without holding the
+        # lock, so peek() from the GUI thread is never kept waiting
+        signal, file_fs = audiomodel.read_wav(key[0])
+        if on_decode is not None:
+            on_decode(path, signal, file_fs)
+        if fs and fs != file_fs:
+            print(f"stimuluscache: Resampling {os.path.basename(path)} " +
+                f"from {file_fs} Hz to {fs} Hz")
+            signal = dsp.resample(signal, file_fs, fs)
+        else:
+            fs = file_fs
+        # Cached arrays are shared: prevent accidental modification
+        signal.flags.writeable = False
+
+        with self._lock:
+            # Another thread may have decoded the same file meanwhile
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self._insert(key, signal, fs)
+
+        return signal, fs
+
+
+    def peek(self, path, fs=None):
+        """ Return cached (signal, fs) for PATH without decoding,
+            or None if PATH is not cached.
+        """
+        try:
+            key = self._make_key(path, fs)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            return self._entries.get(key)
+
+
+    def preload(self, paths, max_dur=None, fs=None, on_decode=None):
+        """ Decode and cache each unique file in PATHS, resampled 
+            to FS if given. Files longer than MAX_DUR seconds 
+            (streamed during playback) and missing files are 
+            skipped. Files that cannot be decoded raise
+            soundfile.LibsndfileError (a RuntimeError). ON_DECODE
+            is passed to get().
+        """
+        unique = list(dict.fromkeys(paths))
+        print(f"\nstimuluscache: Preloading {len(unique)} file(s)...")
+        for path in unique:
+            try:
+                os.stat(path)
+            except FileNotFoundError:
+                # Reported when the trial is presented
+                continue
+            if max_dur and sf.info(path).duration > max_dur:
+                continue
+            self.get(path, fs, on_decode)
+        print(f"stimuluscache: {len(self._entries)} file(s) cached " +
+            f"({self.nbytes / (1024 * 1024):.1f} MB of " +
+            f"{self.budget / (1024 * 1024):.0f} MB)")
+
+
+    def clear(self):
+        """ Remove all entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+    def _insert(self, key, signal, fs):
+        """ Add an entry and evict least recently used entries
+            until the cache fits within the memory budget.
+        """
+        # Do not cache arrays that could never fit
+        if signal.nbytes > self.budget:
+            print(f"stimuluscache: {os.path.basename(key[0])} exceeds " +
+                "the cache budget; not caching")
+            return
+
+        # Remove stale entries for the same path (file changed on 
+        # disk); entries at other sampling rates are kept
+        for old_key in [k for k in self._entries 
+            if k[0] == key[0] and k[1:3] != key[1:3]]:
+            self._evict(old_key)
+
+        self._entries[key] = (signal, fs)
+        self.nbytes += signal.nbytes
+
+        while self.nbytes > self.budget:
+            oldest = next(iter(self._entries))
+            self._evict(oldest)
+
+
+    def _evict(self, key):
+        signal, _ = self._entries.pop(key)
+        self.nbytes -= signal.nbytes
@@ -0,0 +1,254 @@
+""" Index of precomputed stimulus statistics.
+
+    Statistics for each audio file (peak, DC offset, RMS, duration,
+    sampling rate, number of channels and a content hash) are stored
+    in a sidecar file in the audio files directory. Entries are
+    keyed by file name and checked against the file's modification
+    time and size, so only new or changed files are rescanned.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import os
+import json
+import hashlib
+from pathlib import Path
+
+# Import audio packages
+import soundfile as sf
+
+# Import custom modules
+from functions import dsp
+
+
+#########
+# Funcs #
+#########
+def scan_file(path, blocksize=65536):
+    """ Compute per-channel statistics block by block, so memory 
+        use does not depend on file length.
+    """
+    with sf.SoundFile(path) as f:
+        fs = f.samplerate
+        channels = f.channels
+        frames = 0
+        hi = np.full(channels, -np.inf)
+        lo = np.full(channels, np.inf)
+        total = np.zeros(channels)
+        sumsq = np.zeros(channels)
+        for block in f.blocks(blocksize=blocksize, dtype='float32',
+            always_2d=True):
+            frames += len(block)
+            hi = np.maximum(hi, np.max(block, axis=0))
+            lo = np.minimum(lo, np.min(block, axis=0))
+            total += np.sum(block, axis=0, dtype=np.float64)
+            sumsq += np.einsum('ij,ij->j', block, block, dtype=np.float64)
+
+    # Empty files have no meaningful extremes
+    if frames == 0:
+        hi = lo = np.zeros(channels)
+    stats = dsp.peak_stats(hi, lo, total / max(frames, 1))
+
+    return {
+        'peak': stats['peak'].tolist(),
+        'peak_ac': stats['peak_ac'].tolist(),
+        'dc': stats['dc'].tolist(),
+        'rms': np.sqrt(sumsq / max(frames, 1)).tolist(),
+        'dur': frames / fs,
+        'fs': fs,
+        'channels': channels
+    }
+
+
+#########
+# BEGIN #
+#########
+class StimulusIndex:
+    """ Sidecar index of per-file stimulus statistics.
+    """
+    FILENAME = '.stimulus_index.json'
+    VERSION = 1
+
+    def __init__(self, audio_dir):
+        self.audio_dir = Path(audio_dir)
+        self.filepath = self.audio_dir / self.FILENAME
+
+        # Indexed files: file name -> stats dict
+        self.entries = dict()
+        self._dirty = False
+
+        # Files (re)indexed since the last update()
+        self._indexed = 0
+
+        # Load existing sidecar file
+        self.load()
+
+
+    def load(self):
+        """ Load the sidecar file, if it exists.
+        """
+        if not self.filepath.exists():
+            print("\nstimulusindex: No stimulus index found")
+            return
+
+        try:
+            with open(self.filepath, 'r') as fh:
+                raw = json.load(fh)
+        except (OSError, ValueError) as e:
+            print(f"\nstimulusindex: Could not read stimulus index: {e}")
+            return
+
+        # Ignore indexes written by other versions
+        if raw.get('version') == self.VERSION:
+            self.entries = raw.get('files', dict())
+        print(f"\nstimulusindex: Loaded {len(self.entries)} index entries")
+
+
+    def save(self):
+        """ Write the sidecar file if any entries changed.
+        """
+        if not self._dirty:
+            return
+
+        try:
+            with open(self.filepath, 'w') as fh:
+                json.dump({'version': self.VERSION, 'files': self.entries},
+                    fh)
+            self._dirty = False
+        except OSError as e:
+            # Read-only stimulus folders keep an in-memory index only
+            print(f"stimulusindex: Could not write stimulus index: {e}")
+
+
+    def update(self, paths, cache=None):
+        """ Index any files in PATHS that are new or have changed.
+            If a stimuluscache.StimulusCache is provided, statistics
+            are computed from any decoded arrays it already holds.
+        """
+        for path in dict.fromkeys(paths):
+            try:
+                stats = os.stat(path)
+            except FileNotFoundError:
+                # Reported when the trial is presented
+                continue
+
+            name = self._name(path)
+            entry = self.entries.get(name)
+            if self._is_current(entry, stats):
+                continue
+
+            # (Re)compute stats for new or modified file, reusing 
+            # decoded audio if it is already cached
+            cached = None if cache is None else cache.peek(path)
+            if cached is not None:
+                entry = self.compute_stats(*cached)
+            else:
+                entry = scan_file(path)
+            self._store(path, stats, entry)
+
+        print(f"stimulusindex: Indexed {self._indexed} new or modified " +
+            "file(s)")
+        self._indexed = 0
+        self.save()
+
+
+    def add(self, path, signal, fs):
+        """ Index PATH from its decoded SIGNAL (at the file's own 
+            sampling rate FS) if it is new or has changed. Used as 
+            the stimulus cache's on_decode callback, so files are 
+            not read again to be indexed. Call save() afterwards.
+        """
+        try:
+            stats = os.stat(path)
+        except FileNotFoundError:
+            return
+        if not self._is_current(self.entries.get(self._name(path)), stats):
+            self._store(path, stats, self.compute_stats(signal, fs))
+
+
+    def _store(self, path, stats, entry):
+        """ Add ENTRY for PATH with its os.stat() STATS and hash.
+        """
+        entry['mtime_ns'] = stats.st_mtime_ns
+        entry['size'] = stats.st_size
+        entry['hash'] = self._hash_file(path)
+        self.entries[self._name(path)] = entry
+        self._dirty = True
+        self._indexed += 1
+
+
+    def get(self, path):
+        """ Return the stats dict for PATH, or None if PATH is not
+            indexed or has changed since it was indexed.
+        """
+        entry = self.entries.get(self._name(path))
+        try:
+            if self._is_current(entry, os.stat(path)):
+                return entry
+        except FileNotFoundError:
+            pass
+        return None
+
+
+    def peaks(self, paths):
+        """ Return an array of absolute peak values for PATHS.
+            Missing entries are NaN.
+        """
+        lookup = dict()
+        for path in dict.fromkeys(paths):
+            entry = self.get(path)
+            lookup[path] = np.nan if entry is None else max(entry['peak'])
+        return np.array([lookup[path] for path in paths], dtype=float)
+
+
+    @staticmethod
+    def compute_stats(signal, fs):
+        """ Compute per-channel statistics of a decoded signal.
+        """
+        if signal.ndim == 1:
+            signal = signal[:, np.newaxis]
+        stats = dsp.signal_stats(signal)
+        rms = np.sqrt(np.einsum('ij,ij->j', signal, signal,
+            dtype=np.float64) / len(signal))
+
+        return {
+            'peak': stats['peak'].tolist(),
+            'peak_ac': stats['peak_ac'].tolist(),
+            'dc': stats['dc'].tolist(),
+            'rms': rms.tolist(),
+            'dur': len(signal) / fs,
+            'fs': fs,
+            'channels': signal.shape[1]
+        }
+
+
+    def _name(self, path):
+        """ Index key for PATH (relative to the audio directory).
+        """
+        try:
+            return Path(path).relative_to(self.audio_dir).as_posix()
+        except ValueError:
+            return Path(path).as_posix()
+
+
+    def _is_current(self, entry, stats):
+        return (
+            entry is not None and
+            entry['mtime_ns'] == stats.st_mtime_ns and
+            entry['size'] == stats.st_size
+        )
+
+
+    def _hash_file(self, path):
+        """ SHA-256 of file contents, read in chunks.
+        """
+        sha = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
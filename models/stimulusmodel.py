@@ -2,22 +2,30 @@
 """
 
 # Import data science packages
-import pandas as pd
+# (pandas is imported when a task starts, not at app startup)
+import numpy as np
 
 # Import system packages
 import random
 import os
 from pathlib import Path
 
+# Import custom modules
+from models import stimulusindex
+from exceptions import audio_exceptions
+
 
 #########
 # BEGIN #
 #########
 class StimulusModel:
-    def __init__(self, sessionpars):
-        
+    def __init__(self, sessionpars, cache=None):
+        """ sessionpars: a sessionmodel.SessionSnapshot
+            cache: optional stimuluscache.StimulusCache
+        """
         # Assign variables
         self.sessionpars = sessionpars
+        self.cache = cache
 
         #####################
         # Sequence of Funcs #
@@ -32,16 +40,28 @@ class StimulusModel:
         self._do_reps()
 
         # If specified, randomize trials
-        if self.sessionpars['randomize'].get() == 1:
+        if self.sessionpars.randomize == 1:
             self._randomize()
 
+        # Load the index of per-file statistics (peak, RMS, etc.)
+        self._load_index()
+
+        # Decode stimulus files ahead of the first trial (indexing 
+        # them as they are decoded)
+        if self.cache is not None:
+            self._fill_cache()
+
+        # Index any remaining new or modified files
+        self._update_index()
+
 
     def _load_matrix(self):
+        import pandas as pd
         try:
             print('\nstimulusmodel: Reading matrix file')
             # Create private attribute of raw matrix file
             self._matrix_file = pd.read_csv(
-                self.sessionpars['matrix_file_path'].get()
+                self.sessionpars.matrix_file_path
             )
         except FileNotFoundError:
             print('stimulusmodel: File not found!')
@@ -53,7 +73,7 @@ class StimulusModel:
             names in raw matrix file.
         """
         # Get audio files directory
-        audio_dir = Path(self.sessionpars['audio_files_dir'].get())
+        audio_dir = Path(self.sessionpars.audio_files_dir)
 
         for row in self._matrix_file.index:
             # Create full path to audio file
@@ -74,9 +94,10 @@ class StimulusModel:
         self.matrix = self._matrix_file.copy()
 
         # Create repeated trials
+        import pandas as pd
         print('stimulusmodel: Creating trial repetitions')
         self.matrix = pd.concat(
-            [self.matrix] * self.sessionpars['repetitions'].get(), 
+            [self.matrix] * self.sessionpars.repetitions, 
             ignore_index=True
         )
 
@@ -104,36 +125,94 @@ class StimulusModel:
         self.matrix.reset_index(drop=True, inplace=True)
 
 
-    def prep_data(self, current_trial, response, save_list):
-        """ Select data to save and send to csv model.
-            This is tricky because I'm using a dictionary to hold all 
-            the data, and the order that values are entered into the 
-            dict matters.
+    def _fill_cache(self):
+        """ Load each unique audio file in the matrix into the 
+            stimulus cache.
         """
-        # Avoid conflicts and save memory by deleting previous trial data
-        try:
-            del self.trial_data
-        except AttributeError:
-            pass
+        self.cache.preload(self._matrix_file.iloc[:, 0],
+            max_dur=self.sessionpars.stream_threshold_s,
+            fs=self.sessionpars.session_fs or None,
+            on_decode=self.index.add)
 
-        # Dictionary to hold extracted tk variables (with .get())
-        temp = dict()
 
-        # Enter the trial number first so it appears first in the 
-        # output file
-        temp['trial'] = current_trial + 1
+    def _load_index(self):
+        """ Load the stimulus index sidecar file.
+        """
+        self.index = stimulusindex.StimulusIndex(
+            self.sessionpars.audio_files_dir)
+
+
+    def _update_index(self):
+        """ Add any new or modified audio files not indexed while
+            filling the cache (e.g., streamed files) and save the 
+            index.
+        """
+        self.index.update(self._matrix_file.iloc[:, 0], cache=self.cache)
 
-        # Add audio stimulus .wav file name
-        temp['stimulus'] = os.path.basename(
-            self.matrix.iloc[current_trial,0])
 
-        # Get tk variable values and populate temp dict
-        for key in self.sessionpars:
-            temp[key] = self.sessionpars[key].get()
+    def validate_levels(self, calmodel, masker_peak=0.0):
+        """ Check every trial in the matrix for clipping using 
+            indexed peak levels and calibrated presentation levels.
+            MASKER_PEAK is the peak of a background masker mixed 
+            with every trial (worst case: peaks coincide).
+            Raises audio_exceptions.PlannedClipping with a DataFrame
+            of offending trials.
+        """
+        print('\nstimulusmodel: Checking trial plan for clipping')
+        peaks = self.index.peaks(list(self.matrix.iloc[:, 0]))
+        desired = self.matrix.iloc[:, 1].to_numpy(dtype=float)
+        adjusted = calmodel.adjusted_level(desired, 
+            self.sessionpars.slm_offset)
+
+        # Output peak re: full scale for every trial
+        with np.errstate(divide='ignore'):
+            peak_dB = 20 * np.log10(peaks * 10 ** (adjusted / 20) + 
+                masker_peak)
+        clipped = np.flatnonzero(peak_dB > 0)
+
+        # Files without index entries cannot be checked
+        unchecked = np.count_nonzero(np.isnan(peaks))
+        if unchecked:
+            print(f'stimulusmodel: {unchecked} trial(s) could not be ' +
+                'checked (no index entry)')
+
+        if clipped.size:
+            import pandas as pd
+            trials = pd.DataFrame({
+                'trial': clipped + 1,
+                'stimulus': [os.path.basename(x) for x 
+                    in self.matrix.iloc[clipped, 0]],
+                'desired_level_dB': desired[clipped],
+                'adjusted_level_dB': adjusted[clipped],
+                'peak_dBFS': np.round(peak_dB[clipped], 2)
+            })
+            print(f'stimulusmodel: {len(trials)} trial(s) would clip!')
+            print(trials.to_string(index=False))
+            raise audio_exceptions.PlannedClipping(trials)
+
+        print('stimulusmodel: No clipping found')
+
+
+    def prep_data(self, current_trial, response, save_list, levels=None):
+        """ Select data to save and send to csv model.
+            The order of SAVE_LIST sets the column order. Values 
+            come from the trial itself, LEVELS (per-trial values, 
+            e.g., presentation levels) or the session snapshot.
+        """
+        # Values specific to this trial
+        trial_values = {
+            # Trial number
+            'trial': current_trial + 1,
+            # Audio stimulus .wav file name
+            'stimulus': os.path.basename(self.matrix.iloc[current_trial,0])
+        }
+        if levels is not None:
+            trial_values.update(levels)
 
         # Create new dict with only desired items
         try:
-            self.trial_data = dict((k, temp[k]) for k in save_list)
+            self.trial_data = {k: trial_values[k] if k in trial_values 
+                else self.sessionpars[k] for k in save_list}
         except KeyError as e:
             print('\nstimulusmodel: Unexpected variable when attempting ' +
                   f'to save: {e}')
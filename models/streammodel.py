@@ -0,0 +1,141 @@
+""" Block-wise file streaming for long stimuli.
+
+    A reader thread decodes an audio file into a fixed pool of
+    reusable float32 blocks, processes each block (e.g., applies
+    gain) and queues it for the output stream callback. Used blocks
+    are returned to the pool, so memory use is bounded by the pool
+    size regardless of file length.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import queue
+import threading
+
+# Import audio packages
+import soundfile as sf
+
+
+#########
+# BEGIN #
+#########
+class BlockStream:
+    """ Stream an audio file to an output callback in blocks.
+    """
+    def __init__(self, path, process=None, blocksize=4096, max_mb=8):
+        """ path: audio file to stream
+            process: optional function called as process(block,
+                start_frame) on the reader thread; must modify
+                BLOCK in place
+            blocksize: frames per block
+            max_mb: memory ceiling for the block pool
+        """
+        self.path = path
+        self.process = process
+        self.blocksize = blocksize
+
+        with sf.SoundFile(self.path) as f:
+            self.fs = f.samplerate
+            self.channels = f.channels
+            self.frames = f.frames
+
+        # Preallocate block pool within the memory ceiling
+        block_bytes = blocksize * self.channels * 4
+        num_blocks = max(2, int(max_mb * 1024 * 1024 // block_bytes))
+        self._free = queue.Queue()
+        for _ in range(num_blocks):
+            self._free.put(np.empty((blocksize, self.channels),
+                dtype=np.float32))
+        self._filled = queue.Queue()
+        print(f"streammodel: Streaming {self.frames} frames using " +
+            f"{num_blocks} x {blocksize}-frame blocks " +
+            f"({num_blocks * block_bytes / (1024 * 1024):.1f} MB)")
+
+        # Callback state
+        self._block = None
+        self._valid = 0
+        self._pos = 0
+        self.underruns = 0
+        self.finished = False
+
+        # First-sample times, set by the audio engine callback
+        self.onset = None
+        self.onset_dac = None
+
+        # Start reader thread and wait for the first block, so
+        # playback does not start with an underrun
+        self._stop = threading.Event()
+        self._primed = threading.Event()
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+        self._primed.wait(timeout=1.0)
+
+
+    def close(self):
+        """ Stop the reader thread.
+        """
+        self._stop.set()
+        # Unblock reader waiting for a free block
+        self._free.put(None)
+
+
+    def fill(self, outdata, mapping):
+        """ Mix the next frames into OUTDATA (stream callback).
+            Returns True when the whole file has been written.
+        """
+        frames = len(outdata)
+        written = 0
+        while written < frames:
+            # Get the next block, if needed
+            if self._block is None:
+                try:
+                    item = self._filled.get_nowait()
+                except queue.Empty:
+                    # Reader has fallen behind: leave silence
+                    self.underruns += 1
+                    return False
+                if item is None:
+                    self.finished = True
+                    return True
+                self._block, self._valid = item
+                self._pos = 0
+
+            # Copy as much of the block as fits
+            n = min(frames - written, self._valid - self._pos)
+            chunk = self._block[self._pos:self._pos+n, :len(mapping)]
+            outdata[written:written+n, mapping] += chunk
+            written += n
+            self._pos += n
+
+            # Return exhausted block to the pool
+            if self._pos >= self._valid:
+                self._free.put(self._block)
+                self._block = None
+
+        return False
+
+
+    def _read(self):
+        """ Decode, process and queue blocks (reader thread).
+        """
+        start = 0
+        with sf.SoundFile(self.path) as f:
+            while not self._stop.is_set():
+                block = self._free.get()
+                if block is None:
+                    break
+                valid = len(f.read(out=block))
+                if valid == 0:
+                    break
+                if self.process is not None:
+                    self.process(block[:valid], start)
+                start += valid
+                self._filled.put((block, valid))
+                self._primed.set()
+        self._filled.put(None)
+        self._primed.set()
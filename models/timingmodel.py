@@ -0,0 +1,138 @@
+""" Per-trial timing instrumentation.
+
+    Records when present_trial() was called, when the first sample
+    of the stimulus reached the DAC (from the output stream
+    callback), when present_trial() returned and when the response
+    was submitted. All t_* times are in milliseconds from the start
+    of the task (time.perf_counter clock).
+
+    The exception is dac_onset_stream_ms: the DAC time of the first
+    sample in milliseconds on the output stream's own clock, as 
+    reported by the audio device. It is not comparable with the 
+    t_* columns, only with other dac_onset_stream_ms values (e.g.,
+    for onset intervals within a stream).
+
+    Timing log rows are written by a recordsink.RecordSink worker
+    thread, so the log never blocks the Tk event loop.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import csv
+import time
+
+# Import custom modules
+from models import recordsink
+
+
+#########
+# BEGIN #
+#########
+class TrialTimer:
+    """ Collect timing marks for each trial.
+    """
+    COLUMNS = ['t_present_call', 't_onset', 't_present_return',
+        't_submit', 'onset_latency_ms', 'dac_onset_stream_ms']
+
+    def __init__(self, log_path=None):
+        # Reference time for all marks
+        self.t0 = time.perf_counter()
+        self._marks = dict()
+        self.latencies = []
+
+        # Optional timing log (written on a background thread)
+        self.log_path = log_path
+        self._log = None
+        self._writer = None
+        self._sink = None
+        if self.log_path:
+            print(f"\ntimingmodel: Writing timing log to {self.log_path}")
+            self._log = open(self.log_path, 'w', newline='')
+            self._writer = csv.DictWriter(self._log,
+                fieldnames=['trial'] + self.COLUMNS)
+            self._writer.writeheader()
+            self._sink = recordsink.RecordSink(self._write_row)
+
+
+    def _write_row(self, row):
+        """ Write one timing log row (record sink worker thread).
+        """
+        self._writer.writerow(row)
+        self._log.flush()
+
+
+    def _ms(self, t):
+        """ Convert a perf_counter time to ms since task start.
+        """
+        return round((t - self.t0) * 1000, 3)
+
+
+    def mark(self, event):
+        """ Record the current time for EVENT.
+        """
+        self._marks[event] = self._ms(time.perf_counter())
+
+
+    def finish(self, trial, source=None):
+        """ Return the timing columns for TRIAL and reset marks.
+            SOURCE is the audio engine playback source for the
+            trial; its onset is set by the stream callback.
+        """
+        record = {col: self._marks.get(col) for col in self.COLUMNS}
+
+        # Stimulus onset reported by the output stream
+        if source is not None and source.onset is not None:
+            record['t_onset'] = self._ms(source.onset)
+            # Stream clock, not task time (see module docstring)
+            record['dac_onset_stream_ms'] = round(
+                source.onset_dac * 1000, 3)
+        if None not in (record['t_onset'], record['t_present_call']):
+            record['onset_latency_ms'] = round(
+                record['t_onset'] - record['t_present_call'], 3)
+            self.latencies.append(record['onset_latency_ms'])
+
+        if self._sink is not None:
+            self._sink.put({'trial': trial, **record})
+
+        self._marks = dict()
+        return record
+
+
+    def summary(self):
+        """ Print and return onset latency percentiles (ms).
+        """
+        if not self.latencies:
+            return dict()
+
+        values = np.array(self.latencies)
+        stats = {
+            'n': len(values),
+            'p50': np.percentile(values, 50),
+            'p95': np.percentile(values, 95),
+            'p99': np.percentile(values, 99),
+            'max': np.max(values),
+            'jitter_sd': np.std(values)
+        }
+        print("\ntimingmodel: Onset latency (ms): " +
+            ", ".join(f"{k}={v:.2f}" for k, v in stats.items() if k != 'n') +
+            f" (n={stats['n']})")
+        return stats
+
+
+    def close(self):
+        """ Close the timing log.
+        """
+        if self._sink is not None:
+            self._sink.close()
+            for e in self._sink.errors():
+                print(f"timingmodel: Timing log write failed: {e!r}")
+            self._sink = None
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+            self._writer = None
@@ -1,7 +1,13 @@
 """ Class to check current version number against latest version 
     library on Starfile. If upgrade is available, display
     a message. If upgrade is mandatory, show warning and 
-    kill app. 
+    do not allow the task to start. 
+
+    The library is copied to a local cache, which is reused until 
+    it is older than TTL_S (or whenever the library cannot be 
+    reached). BackgroundVersionCheck runs the check on a worker 
+    thread with a hard timeout, so a slow file server never blocks 
+    the GUI.
 
     Written by: Travis M. Moore
     Created: Apr 11, 2023
@@ -10,8 +16,22 @@
 ###########
 # Imports #
 ###########
-# Data science
-import pandas as pd
+# Import system packages
+import os
+import time
+import shutil
+import threading
+from pathlib import Path
+
+
+#############
+# Constants #
+#############
+# Maximum age of the cached version library (seconds)
+TTL_S = 24 * 60 * 60
+
+# Maximum time to wait for the version library (seconds)
+TIMEOUT_S = 5.0
 
 
 #########
@@ -23,10 +43,13 @@ class VersionChecker:
         return TRUE and display a message. If upgrade is mandatory, 
         return FALSE, display a message, and kill app. 
     """
-    def __init__(self, lib_path, app_name, app_version):
+    def __init__(self, lib_path, app_name, app_version, cache_path=None,
+        ttl_s=TTL_S):
         self.lib_path = lib_path
         self.app_name = app_name
         self.app_version = app_version
+        self.cache_path = cache_path
+        self.ttl_s = ttl_s
         self.status = None
 
         # Import version library to cross-reference
@@ -72,10 +95,109 @@ class VersionChecker:
 
 
     def import_version_library(self, lib_path):
-        """ Load version library
+        """ Load version library (from the local cache, if given)
         """
+        # pandas is slow to import: load it only when checking
+        import pandas as pd
+
+        if self.cache_path is not None:
+            lib_path = self._update_cache(lib_path)
+
         # Download version library for crossreferencing
         try:
             self.version_library = pd.read_csv(lib_path)
         except FileNotFoundError:
             raise FileNotFoundError
+
+
+    def _update_cache(self, lib_path):
+        """ Refresh the cached copy of the version library if it 
+            is missing or older than the TTL. A stale copy is used 
+            if the library cannot be reached. Returns the cache path.
+        """
+        cache = Path(self.cache_path)
+        try:
+            age = time.time() - cache.stat().st_mtime
+        except FileNotFoundError:
+            age = None
+
+        if age is not None and age < self.ttl_s:
+            print("updater: Using cached version library")
+            return cache
+
+        try:
+            # Copy, then rename, so the cache is never half-written
+            temp = cache.with_suffix('.tmp')
+            shutil.copyfile(lib_path, temp)
+            os.replace(temp, cache)
+            print("updater: Updated cached version library")
+        except OSError as e:
+            if age is None:
+                raise FileNotFoundError(lib_path)
+            print(f"updater: Cannot reach version library ({e}); " +
+                "using cached copy")
+        return cache
+
+
+class BackgroundVersionCheck:
+    """ Run a VersionChecker on a worker thread. Poll done() from 
+        the GUI thread; after TIMEOUT_S without a result the status 
+        becomes 'library_inaccessible'.
+    """
+    def __init__(self, lib_path, app_name, app_version, cache_path=None,
+        ttl_s=TTL_S, timeout_s=TIMEOUT_S):
+        self.app_version = app_version
+        self.new_version = None
+        self.status = 'pending'
+
+        self._checker = None
+        self._finished = threading.Event()
+        self._deadline = time.monotonic() + timeout_s
+        threading.Thread(
+            target=self._run,
+            args=(lib_path, app_name, app_version, cache_path, ttl_s),
+            daemon=True
+        ).start()
+
+
+    def _run(self, *args):
+        """ Check for updates (worker thread).
+        """
+        try:
+            self._checker = VersionChecker(*args)
+        except Exception as e:
+            print(f"updater: Version check failed: {e!r}")
+        finally:
+            self._finished.set()
+
+
+    def done(self):
+        """ Return True once the status is known (a result arrived
+            or the check timed out). Does not block.
+        """
+        if self.status != 'pending':
+            return True
+
+        if self._finished.is_set():
+            if self._checker is None:
+                self.status = 'library_inaccessible'
+            else:
+                self.status = self._checker.status
+                self.new_version = getattr(self._checker, 'new_version',
+                    None)
+            return True
+
+        if time.monotonic() >= self._deadline:
+            print("updater: Version check timed out!")
+            self.status = 'library_inaccessible'
+            return True
+
+        return False
+
+
+    def wait(self):
+        """ Block until the status is known (at most until the 
+            timeout).
+        """
+        self._finished.wait(max(self._deadline - time.monotonic(), 0))
+        return self.done()
@@ -8,8 +8,8 @@
 import tkinter as tk
 from tkinter import ttk
 
-# Import audio packages
-import sounddevice as sd
+# Import custom modules
+from models import audiobackend
 
 
 #########
@@ -18,10 +18,13 @@ import sounddevice as sd
 class AudioDialog(tk.Toplevel):
     """ Audio device dialog.
     """
-    def __init__(self, parent, sessionpars, *args, **kwargs):
+    def __init__(self, parent, sessionpars, registry, engine, *args, 
+        **kwargs):
         super().__init__(parent, *args, *kwargs)
         self.parent = parent
         self.sessionpars = sessionpars
+        self.registry = registry
+        self.engine = engine
 
         # Window setup
         self.withdraw()
@@ -54,6 +57,10 @@ class AudioDialog(tk.Toplevel):
         lfrm_routing = ttk.LabelFrame(self, text="Channel Routing")
         lfrm_routing.grid(column=5, row=5, **options, sticky='we')
 
+        # Latency profile
+        lfrm_latency = ttk.LabelFrame(self, text="Latency Profile")
+        lfrm_latency.grid(column=5, row=7, **options, sticky='we')
+
         # Audio device table
         self.frm_tree = ttk.Frame(self)
         self.frm_tree.grid(column=5, row=10, **options)
@@ -71,12 +78,65 @@ class AudioDialog(tk.Toplevel):
         self.routing_var = tk.StringVar(value=self.sessionpars['channel_routing'].get())
         ttk.Entry(lfrm_routing, textvariable=self.routing_var).grid(column=10, row=5)
 
+        # Audio backend (the virtual device plays nothing)
+        ttk.Label(lfrm_routing, text="Audio Backend:").grid(
+            column=5, row=15, padx=5, pady=(0, 10), sticky='e')
+        ttk.Combobox(lfrm_routing, state='readonly', width=17,
+            values=list(audiobackend.BACKENDS), 
+            textvariable=self.sessionpars['audio_backend']).grid(
+            column=10, row=15, pady=(0, 10))
+
+        # Session sampling rate (0 = use each file's own rate)
+        ttk.Label(lfrm_routing, text="Sampling Rate (Hz):").grid(
+            column=5, row=10, padx=5, pady=(0, 10), sticky='e')
+        ttk.Entry(lfrm_routing, textvariable=self.sessionpars['session_fs']
+            ).grid(column=10, row=10, pady=(0, 10))
+        ttk.Label(lfrm_routing, text="(0 = file rate)").grid(
+            column=15, row=10, padx=5, pady=(0, 10))
+
+        # Latency ('low', 'high' or seconds)
+        ttk.Label(lfrm_latency, text="Latency:").grid(
+            column=5, row=5, padx=5, pady=(10, 5), sticky='e')
+        ttk.Combobox(lfrm_latency, values=['low', 'high'], width=10,
+            textvariable=self.sessionpars['latency']).grid(
+            column=10, row=5, pady=(10, 5), sticky='w')
+        ttk.Label(lfrm_latency, text="('low', 'high' or seconds)").grid(
+            column=15, row=5, padx=5, pady=(10, 5), sticky='w')
+
+        # Block size (0 = let the host API choose)
+        ttk.Label(lfrm_latency, text="Block Size (frames):").grid(
+            column=5, row=10, padx=5, pady=5, sticky='e')
+        ttk.Entry(lfrm_latency, width=10,
+            textvariable=self.sessionpars['blocksize']).grid(
+            column=10, row=10, pady=5, sticky='w')
+        ttk.Label(lfrm_latency, text="(0 = host default)").grid(
+            column=15, row=10, padx=5, pady=5, sticky='w')
+
+        # Dither and exclusive mode
+        ttk.Checkbutton(lfrm_latency, text="Disable dithering",
+            takefocus=0, variable=self.sessionpars['dither_off']).grid(
+            column=5, columnspan=15, row=15, padx=5, pady=5, sticky='w')
+        ttk.Checkbutton(lfrm_latency, text="WASAPI exclusive mode",
+            takefocus=0, variable=self.sessionpars['wasapi_exclusive']).grid(
+            column=5, columnspan=15, row=20, padx=5, pady=5, sticky='w')
+
+        # Latency reported by the open stream
+        ttk.Label(lfrm_latency, text="Reported Latency:").grid(
+            column=5, row=25, padx=5, pady=(5, 10), sticky='e')
+        ttk.Label(lfrm_latency, text=self.engine.latency_report()).grid(
+            column=10, columnspan=10, row=25, pady=(5, 10), sticky='w')
+
         # Create treeview
         # Treeview instructions label
         ttk.Label(self.frm_tree, text="Click on an audio device below to " +
             "select it.", style='Bold.TLabel').grid(row=5, column=5)
         self.tree = self._create_tree_widget()
 
+        # Refresh device list button
+        ttk.Button(self.frm_tree, text="Refresh Devices", 
+            command=self._refresh_devices).grid(row=15, column=5, 
+            pady=(10, 0))
+
         # Submit button
         ttk.Button(frm_submit, text="Submit", command=self._on_submit).grid(
             column=5, columnspan=15, row=5)
@@ -106,33 +166,50 @@ class AudioDialog(tk.Toplevel):
         tree.configure(yscroll=scrollbar.set)
         scrollbar.grid(row=10, column=6, sticky='ns')
 
-        # Get data
-        devices = self._query_audio_devices()
-
-        # Populate tree
-        for device in devices:
-            tree.insert('', tk.END, values=device)
+        # Populate tree once devices have been enumerated
+        self.after_idle(lambda: self._populate_tree(tree))
 
         return tree
 
 
+    def _populate_tree(self, tree):
+        """ Fill the tree with cached devices. If enumeration is
+            still running, check again shortly without blocking.
+        """
+        if not self.registry.wait(timeout=0):
+            tree.delete(*tree.get_children())
+            tree.insert('', tk.END, values=('', 'Searching for devices...', ''))
+            self.after(100, lambda: self._populate_tree(tree))
+            return
+
+        tree.delete(*tree.get_children())
+        for device in self._query_audio_devices():
+            tree.insert('', tk.END, values=device)
+
+
     def _query_audio_devices(self):
         """ Create list of tuples with specified device information.
         """
-        # Get list of audio devices
-        deviceList = sd.query_devices()
-        print("\naudioview: Audio Devcie List")
-        print(deviceList)
-        
-        # Create list of tuples with device info
+        # Create list of tuples with cached device info
         devices = []
-        for ii in range(0,len(deviceList)):
-            if deviceList[ii]['max_output_channels'] > 0:
-                devices.append((ii, deviceList[ii]['name'], deviceList[ii]['max_output_channels']))
+        for dev in self.registry.output_devices():
+            devices.append((dev['id'], dev['name'], 
+                dev['max_output_channels']))
+        print(f"\naudioview: Found {len(devices)} output device(s)")
 
         return devices
 
 
+    def _refresh_devices(self):
+        """ Close all streams, re-enumerate audio devices (picking
+            up devices that were plugged in or removed) and 
+            repopulate the tree.
+        """
+        self.engine.close()
+        self.registry.refresh(rescan=True)
+        self._populate_tree(self.tree)
+
+
     #################
     # General Funcs #
     #################
@@ -157,6 +234,10 @@ class AudioDialog(tk.Toplevel):
             item = self.tree.item(selected_item)
             record = item['values']
 
+            # Ignore placeholder row
+            if record[0] == '':
+                continue
+
             # Update sessionpars with device id
             self.sessionpars['audio_device'].set(record[0])
 
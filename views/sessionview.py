@@ -12,6 +12,7 @@ from tkinter import filedialog
 
 # Import custom modules
 from functions import general
+from functions import dsp
 
 
 #########
@@ -46,6 +47,10 @@ class SessionDialog(tk.Toplevel):
         frm_options = ttk.Labelframe(self, text='Stimulus Options')
         frm_options.grid(row=10, column=5, **frame_options, sticky='nsew')
 
+        # Background masker frame
+        frm_masker = ttk.Labelframe(self, text='Background Masker')
+        frm_masker.grid(row=12, column=5, **frame_options, sticky='nsew')
+
         # Audio file browser frame
         frm_audiopath = ttk.Labelframe(self, text="Audio File Directory")
         frm_audiopath.grid(row=15, column=5, **frame_options, ipadx=5, 
@@ -88,6 +93,74 @@ class SessionDialog(tk.Toplevel):
             textvariable=self.sessionpars['repetitions']
             ).grid(row=10, column=10, sticky='w')
 
+        # Timing log
+        chk_timing = ttk.Checkbutton(frm_options, text="Write timing log",
+            takefocus=0, variable=self.sessionpars['timing_log'])
+        chk_timing.grid(row=15, column=5,  columnspan=20, sticky='w', 
+            **widget_options)
+
+        # Trial journal
+        chk_journal = ttk.Checkbutton(frm_options, 
+            text="Write crash-safe trial journal",
+            takefocus=0, variable=self.sessionpars['journal'])
+        chk_journal.grid(row=17, column=5,  columnspan=20, sticky='w', 
+            **widget_options)
+
+        # SQLite store
+        chk_sqlite = ttk.Checkbutton(frm_options, 
+            text="Also save to SQLite database",
+            takefocus=0, variable=self.sessionpars['sqlite_store'])
+        chk_sqlite.grid(row=18, column=5,  columnspan=20, sticky='w', 
+            **widget_options)
+
+        # Onset/offset ramps
+        ttk.Label(frm_options, text="Ramp Shape:"
+            ).grid(row=20, column=5, sticky='e', **widget_options)
+        ttk.Combobox(frm_options, width=17, state='readonly',
+            values=dsp.RAMP_SHAPES, 
+            textvariable=self.sessionpars['ramp_shape']
+            ).grid(row=20, column=10, sticky='w')
+        ttk.Label(frm_options, text="Ramp Duration (ms):"
+            ).grid(row=25, column=5, sticky='e', **widget_options)
+        ttk.Entry(frm_options, width=20, 
+            textvariable=self.sessionpars['ramp_dur_ms']
+            ).grid(row=25, column=10, sticky='w')
+
+
+        #####################
+        # Background Masker #
+        #####################
+        # Masker file
+        ttk.Label(frm_masker, text="File:"
+            ).grid(row=5, column=5, sticky='e', **widget_options)
+        masker_file = self.sessionpars['masker_file'].get()
+        self.masker_var = tk.StringVar(
+            value=general.truncate_path(masker_file) if masker_file else 'None')
+        ttk.Label(frm_masker, textvariable=self.masker_var, 
+            borderwidth=2, relief="solid", width=60
+            ).grid(row=5, column=10, columnspan=10, sticky='w')
+        ttk.Button(frm_masker, text="Browse", 
+            command=self._get_masker_file,
+            ).grid(row=10, column=10, sticky='w')
+        ttk.Button(frm_masker, text="None", 
+            command=self._clear_masker_file,
+            ).grid(row=10, column=15, sticky='w')
+
+        # Masker level
+        ttk.Label(frm_masker, text="Level (dB):"
+            ).grid(row=15, column=5, sticky='e', **widget_options)
+        ttk.Entry(frm_masker, width=20, 
+            textvariable=self.sessionpars['masker_level_dB']
+            ).grid(row=15, column=10, columnspan=10, sticky='w')
+
+        # Target onset delay
+        ttk.Label(frm_masker, text="Target Delay (ms):"
+            ).grid(row=20, column=5, sticky='e', **widget_options)
+        ttk.Entry(frm_masker, width=20, 
+            textvariable=self.sessionpars['target_delay_ms']
+            ).grid(row=20, column=10, columnspan=10, sticky='w', 
+            pady=(0, 10))
+
 
         ###################
         # Audio Directory #
@@ -188,6 +261,27 @@ class SessionDialog(tk.Toplevel):
         self.matrix_var.set(general.truncate_path(filename))
 
 
+    def _get_masker_file(self):
+        """ Get path to background masker file
+        """
+        # Get file from dialog
+        filename = filedialog.askopenfilename(title="Masker File", 
+            filetypes=[("WAV", "*.wav")])
+
+        # Update sessionpars with masker file path
+        self.sessionpars['masker_file'].set(filename)
+
+        # Update masker label
+        self.masker_var.set(general.truncate_path(filename))
+
+
+    def _clear_masker_file(self):
+        """ Turn off the background masker
+        """
+        self.sessionpars['masker_file'].set('')
+        self.masker_var.set('None')
+
+
     def _check_presentations(self):
         if self.sessionpars['repetitions'].get() == 0:
             self.sessionpars['repetitions'].set(1)